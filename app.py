@@ -1,6 +1,7 @@
 import argparse
 import json
 import os
+import threading
 from flask_api import FlaskAPI
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
@@ -12,6 +13,15 @@ import logging
 from constants import ADD_MODELS, PROTECTED_PATH, db
 from controllers.accounts import account_ns
 from controllers.vaccines import vaccination_ns
+from controllers.jobs import jobs_ns
+from controllers.monitoring import metrics_ns, monitoring_ns
+from models.user import User
+from models.vaccination_summary import VaccinationSummary
+from service import compaction, jobs
+from service.stats import rebuild_summary
+from utils import admission, compression, hashing, http_cache, metrics, replicas, search
+from utils.cache import is_process_local
+from utils.db_pool import engine_options
 
 LOG =logging.getLogger("root")
 
@@ -33,11 +43,52 @@ class Initializer:
         migrate_parser.add_argument("--init", action="store_true")
         migrate_parser.add_argument("--migrate", action="store_true")
         migrate_parser.add_argument("--upgrade", action="store_true")
+        migrate_parser.add_argument("--rebuild-stats", action="store_true")
+        migrate_parser.add_argument("--backfill-doses", action="store_true")
 
     @staticmethod
     def add_run_args(subparser):
         subparser.add_parser("run", help="run the application")
 
+    @staticmethod
+    def add_serve_args(subparser):
+        serve_parser = subparser.add_parser("serve", help="run the application on the multi-process production server")
+        serve_parser.add_argument("--workers", type=int)
+        serve_parser.add_argument("--threads", type=int)
+
+    @staticmethod
+    def add_compact_args(subparser):
+        compact_parser = subparser.add_parser("compact", help="purge the expired tombstones of deleted users now")
+        compact_parser.add_argument("--retention-days", type=int)
+
+    @staticmethod
+    def add_worker_args(subparser):
+        worker_parser = subparser.add_parser("worker", help="run background jobs in a dedicated process")
+        worker_parser.add_argument("--threads", type=int)
+
+    @staticmethod
+    def add_explain_args(subparser):
+        explain_parser = subparser.add_parser("explain", help="fail unless the filter queries use their indexes")
+        explain_parser.add_argument("--min-users", type=int, default=1000000)
+
+    @staticmethod
+    def add_bench_args(subparser):
+        bench_parser = subparser.add_parser("bench", help="seed a synthetic population and run the load test")
+        bench_parser.add_argument("--seed", action="store_true", help="seed the database before the run")
+        bench_parser.add_argument("--reset", action="store_true", help="drop all tables before seeding")
+        bench_parser.add_argument("--users", type=int, default=10000)
+        bench_parser.add_argument("--doses", action="store_true", help="backfill the Dose table after seeding")
+        bench_parser.add_argument("--requests", type=int, default=10000)
+        bench_parser.add_argument("--concurrency", type=int, default=8)
+        bench_parser.add_argument("--mix", default="default")
+        bench_parser.add_argument("--traffic", help="JSONL file of recorded requests to replay")
+        bench_parser.add_argument("--explain", action="store_true", help="check the filter queries use indexes")
+        bench_parser.add_argument(
+            "--admission", action="store_true", help="keep login / register admission control on"
+        )
+        bench_parser.add_argument("--random-seed", type=int, default=42)
+        bench_parser.add_argument("--output", help="file to write the JSON report to")
+
     def parse_config(self):
         parser = argparse.ArgumentParser()
         # Add default normal arguments here
@@ -52,6 +103,11 @@ class Initializer:
         subparser.required = True
         # Initialize subparser
         Initializer.add_run_args(subparser)
+        Initializer.add_serve_args(subparser)
+        Initializer.add_bench_args(subparser)
+        Initializer.add_explain_args(subparser)
+        Initializer.add_compact_args(subparser)
+        Initializer.add_worker_args(subparser)
         Initializer.add_migrate_args(subparser)
         self.args = parser.parse_args()
         try:
@@ -75,11 +131,36 @@ class Initializer:
                     migrate()
                 elif self.args.upgrade:
                     upgrade()
+                elif self.args.rebuild_stats:
+                    rebuild_summary()
+                elif self.args.backfill_doses:
+                    User.backfill_doses()
 
         # Run the application
         if self.args.command == "run":
             self.run()
 
+        if self.args.command == "serve":
+            self.serve()
+
+        if self.args.command == "compact":
+            config = dict(self.app.config["COMPACTOR"])
+            if self.args.retention_days is not None:
+                config["RETENTION_DAYS"] = self.args.retention_days
+            with self.app.app_context():
+                self.log.info("Purged {} deleted users".format(compaction.purge(config)))
+
+        if self.args.command == "worker":
+            self.work()
+
+        if self.args.command == "bench":
+            from benchmarks.loadtest import run as run_benchmark
+            run_benchmark(self.app, self.args)
+
+        if self.args.command == "explain":
+            from benchmarks.explain import run as run_explain
+            run_explain(self.app, self.args)
+
     def _prepare_app(self):
         # Create attributes from json
         self.create_vars(self.configs)
@@ -102,25 +183,86 @@ class Initializer:
         self.check_configs()
 
     def run(self):
-        # Running the application
-        self.app.run(host ='0.0.0.0',port=8080)
+        # Running the application on the development server
+        compaction.start(self.app, self.app.config["COMPACTOR"])
+        jobs.start(self.app)
+        self.app.run(host='0.0.0.0', port=self.PORT or 8080)
+
+    def serve(self):
+        # Running the application on the pre-forking production server
+        from utils.server import SERVER_DEFAULTS, Server
+        config = dict(getattr(self, "SERVER", {}))
+        if self.args.workers:
+            config["WORKERS"] = self.args.workers
+        if self.args.threads:
+            config["THREADS"] = self.args.threads
+        if config.get("WORKERS", SERVER_DEFAULTS["WORKERS"]) > 1:
+            self._disable_process_local_caches()
+        # every worker runs a compactor, concurrent purges skip each other's rows
+        post_fork_hooks = [lambda app: compaction.start(app, app.config["COMPACTOR"]), jobs.start]
+        Server(self.app, port=self.PORT or 8080, config=config, post_fork_hooks=post_fork_hooks).run()
+
+    def _disable_process_local_caches(self):
+        # a write only invalidates the memory cache of the worker serving it,
+        # the other workers would keep serving the old rows until the TTL
+        if is_process_local(self.app.config["USER_CACHE"]):
+            self.log.warning("USER_CACHE memory backend is disabled with several workers, use redis")
+            User.configure_cache({"BACKEND": "none"})
+        if is_process_local(self.app.config["RESPONSE_CACHE"]):
+            # ETags then come from the updated_at of the row on every request
+            self.log.warning("RESPONSE_CACHE memory backend is disabled with several workers, use redis")
+            http_cache.configure({"BACKEND": "none"})
+
+    def work(self):
+        # Running background jobs only, next to or instead of the server workers
+        jobs.settings["ENABLED"] = True
+        if self.args.threads:
+            jobs.settings["THREADS"] = self.args.threads
+        jobs.start(self.app)
+        self.log.info("Job worker started")
+        threading.Event().wait()
 
     def create_app(self):
         app = FlaskAPI(__name__, instance_relative_config=True, instance_path=PROTECTED_PATH)
         self.initialize_models(app)
+        metrics.init_app(app)
+        replicas.init_app(app)
+        compression.init_app(app)
         CORS(app)
         return app
 
     def initialize_models(self, app):
         # Use the same or modify your db or app config here.
-        app.config["COMPRESS_REGISTER"] = False
-        app.config["COMPRESS_ALGORITHM"] = "gzip"
-        app.config["COMPRESS_MIMETYPES"] = ["image/svg+xml"]
+        app.config["COMPRESSION"] = getattr(self, "COMPRESSION", {})
+        compression.configure(app.config["COMPRESSION"])
         app.config["SECRET_KEY"] = self.SECRET_KEY
         app.config["SQLALCHEMY_DATABASE_URI"] = self.DB_CONNECTION_STRING
         app.config["DB_CONNECTION_POOL"] = self.DB_CONNECTION_POOL
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            self.DB_CONNECTION_POOL, self.DB_CONNECTION_STRING
+        )
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = self.SQLALCHEMY_TRACK_MODIFICATIONS
+        app.config["DB_REPLICAS"] = getattr(self, "DB_REPLICAS", {})
+        app.config["SQLALCHEMY_BINDS"] = replicas.configure(app.config["DB_REPLICAS"])
+        app.config["USER_CACHE"] = getattr(self, "USER_CACHE", {})
         db.init_app(app)
+        User.configure_cache(app.config["USER_CACHE"])
+        app.config["RESPONSE_CACHE"] = getattr(self, "RESPONSE_CACHE", {"BACKEND": "none"})
+        http_cache.configure(app.config["RESPONSE_CACHE"])
+        app.config["PASSWORD_HASHING"] = getattr(self, "PASSWORD_HASHING", {})
+        hashing.configure(app.config["PASSWORD_HASHING"])
+        app.config["ADMISSION_CONTROL"] = getattr(self, "ADMISSION_CONTROL", {})
+        admission.configure(app.config["ADMISSION_CONTROL"])
+        app.config["VACCINATION_STATS"] = getattr(self, "VACCINATION_STATS", {})
+        VaccinationSummary.enabled = app.config["VACCINATION_STATS"].get("SUMMARY", False)
+        VaccinationSummary.shards = app.config["VACCINATION_STATS"].get("SHARDS", 1)
+        app.config["COMPACTOR"] = getattr(self, "COMPACTOR", {})
+        app.config["JOBS"] = getattr(self, "JOBS", {})
+        jobs.configure(app.config["JOBS"])
+        app.config["AUTH"] = getattr(self, "AUTH", {})
+        User.token_epochs.refresh_interval = app.config["AUTH"].get("EPOCH_REFRESH_SECONDS", 5)
+        app.config["SEARCH"] = getattr(self, "SEARCH", {})
+        search.configure(app.config["SEARCH"], self.DB_CONNECTION_STRING)
         return
 
     def initialize_namespaces(self):
@@ -128,6 +270,9 @@ class Initializer:
         # Create namespaces
         self.api.add_namespace(ns=account_ns)
         self.api.add_namespace(ns=vaccination_ns)
+        self.api.add_namespace(ns=monitoring_ns)
+        self.api.add_namespace(ns=metrics_ns)
+        self.api.add_namespace(ns=jobs_ns)
 
     def _set_env_variables(self):
         os.environ["SECRET_KEY"] = self.SECRET_KEY
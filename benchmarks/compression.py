@@ -0,0 +1,56 @@
+"""
+Bandwidth / CPU trade-off of response compression on fetch_accounts bodies.
+For every encoding and level reports the body size before and after
+compression, the ratio and the CPU time spent, against a throw away SQLite
+database, from the repository root:
+    python -m benchmarks.compression --rows 10000 100000 --levels 1 6 9
+"""
+import argparse
+import json
+import time
+
+from benchmarks.serialization import core_path, create_app, seed
+from utils import compression
+
+
+def measure(body, encoding, level, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        engine = compression.compressor(encoding, level)
+        compressed = engine.compress(body) + engine.finish()
+        timings.append(time.process_time() - started)
+    cpu = min(timings)
+    return {
+        "encoding": encoding,
+        "level": level,
+        "bytes_in": len(body),
+        "bytes_out": len(compressed),
+        "ratio": round(len(body) / len(compressed), 2),
+        "cpu_seconds": round(cpu, 4),
+        "mb_per_cpu_second": round(len(body) / cpu / 1e6, 1) if cpu else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db", default="sqlite:////tmp/vmp_compression_bench.db")
+    args = parser.parse_args()
+
+    app = create_app(args.db)
+    with app.app_context():
+        for rows in args.rows:
+            seed(rows)
+            body = core_path().encode()
+            print(json.dumps({"rows": rows, "encoding": "identity", "bytes": len(body)}))
+            for encoding in compression.available_encodings():
+                for level in args.levels:
+                    # brotli qualities go up to 11, zlib levels up to 9
+                    print(json.dumps(dict(measure(body, encoding, level, args.repeat), rows=rows)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Checks that the filter queries of fetch_accounts are served by indexes.
+Runs EXPLAIN (PostgreSQL) / EXPLAIN QUERY PLAN (SQLite) on the keyset page
+query and the count query of every filter and reports the plans. The explain
+subcommand of app.py fails when a page query scans the table or a count query
+misses the index of its filter. Run it on a vacuumed database of 1M+ users
+(--min-users): the plans of small tables are seq scans anyway, and a first
+page ordered by id is rightly read off the primary key when the filter
+matches many rows.
+"""
+import datetime
+import json
+import logging
+
+from sqlalchemy import and_, func, select
+
+from constants import db
+from models.user import User
+
+LOG = logging.getLogger("root")
+
+# filter -> (criteria, index expected in the plan)
+FILTER_QUERIES = {
+    "gender": ([User.gender == "Female"], "ix_user_gender_id"),
+    "age": ([User.age == 42], "ix_user_age_id"),
+    "is_fully_vaccinated": ([User.is_fully_vaccinated == "Yes"], "ix_user_is_fully_vaccinated_id"),
+    "first_doze_taken": ([User.first_doze_taken == "No"], "ix_user_first_doze_taken_id"),
+    "second_doze_taken": ([User.second_doze_taken == "No"], "ix_user_second_doze_taken_id"),
+    "first_doze_date_range": (
+        [User.first_doze_date.between(datetime.date(2021, 3, 1), datetime.date(2021, 4, 1))],
+        "ix_user_first_doze_date_id",
+    ),
+    "second_doze_date_before": ([User.second_doze_date < datetime.date(2021, 6, 1)], "ix_user_second_doze_date_id"),
+}
+
+
+def explain(statement):
+    """
+    Returns the plan lines of a select statement
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect)
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    rows = connection.execute(prefix + str(compiled), params)
+    return [" ".join(str(value) for value in row) for row in rows]
+
+
+def _scans_table(plan):
+    # PostgreSQL "Seq Scan", SQLite "SCAN <table>" without an index
+    return any("Seq Scan" in line or ("SCAN" in line.split() and "USING" not in line) for line in plan)
+
+
+def check_indexes(limit=100):
+    """
+    Returns {filter: {"index": name, "uses_index": bool, "plan": [...], "count_plan": [...]}}
+    """
+    report = {}
+    for name, (criteria, index) in FILTER_QUERIES.items():
+        statement = User._select(User.RESPONSE_FIELDS, criteria).order_by(User.id).limit(limit)
+        plan = explain(statement)
+        count_plan = explain(select([func.count(User.id)]).where(and_(User.live(), *criteria)))
+        report[name] = {
+            "index": index,
+            "uses_index": (
+                not _scans_table(plan)
+                and any(index in line for line in count_plan)
+            ),
+            "plan": plan,
+            "count_plan": count_plan,
+        }
+    return report
+
+
+def run(app, args):
+    with app.app_context():
+        users = User.count([])
+        if users < args.min_users:
+            raise SystemExit("{} users, seed at least {} to check the plans".format(users, args.min_users))
+        report = check_indexes()
+    print(json.dumps(report, indent=2))
+    missing = sorted(name for name, entry in report.items() if not entry["uses_index"])
+    if missing:
+        raise SystemExit("Filter queries not using their index: {}".format(", ".join(missing)))
+    LOG.info("Every filter query of {} users uses its index".format(users))
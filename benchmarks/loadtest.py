@@ -0,0 +1,178 @@
+"""
+Load test harness.
+Seeds a synthetic population (optional), replays a generated or recorded
+traffic mix through the Flask app with concurrent test clients and reports
+throughput and p50/p95/p99 latency per operation as JSON, so runs can be
+compared over time. Started through the bench subcommand of app.py:
+    python app.py -ac bench_config.json bench --seed --users 100000 --requests 20000
+"""
+import datetime
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+from queue import Empty, Queue
+
+from sqlalchemy import func
+
+from benchmarks import population, traffic
+from benchmarks.explain import check_indexes
+from constants import db
+from models.user import User
+from utils import admission
+
+SAMPLE_USERS = 10000
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class Replayer:
+    """Sends requests from a shared queue through concurrent test clients"""
+
+    def __init__(self, app, sample, admin_token, rng):
+        self.app = app
+        self.sample = sample
+        self.admin_token = admin_token
+        self.rng = rng
+        self.rng_lock = threading.Lock()
+        self.results = []
+        self.results_lock = threading.Lock()
+
+    def _prepare(self, request):
+        with self.rng_lock:
+            user_id, email, token = self.rng.choice(self.sample)
+        headers = {}
+        if request.get("auth") == "admin":
+            headers["AUTHORIZATION"] = self.admin_token
+        elif request.get("auth") == "user":
+            headers["AUTHORIZATION"] = token
+        return request["path"].replace("{user_id}", str(user_id)), headers
+
+    def _worker(self, queue):
+        client = self.app.test_client()
+        timings = []
+        while True:
+            try:
+                request = queue.get_nowait()
+            except Empty:
+                break
+            path, headers = self._prepare(request)
+            started = time.perf_counter()
+            response = client.open(
+                path,
+                method=request["method"],
+                query_string=request.get("query"),
+                json=request.get("json"),
+                headers=headers,
+            )
+            response.get_data()
+            timings.append((request["op"], response.status_code, time.perf_counter() - started))
+        with self.results_lock:
+            self.results.extend(timings)
+
+    def replay(self, requests, concurrency):
+        queue = Queue()
+        for request in requests:
+            queue.put(request)
+        workers = [threading.Thread(target=self._worker, args=(queue,)) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    per_op = {}
+    for op, status, seconds in results:
+        per_op.setdefault(op, []).append((status, seconds))
+    operations = {}
+    for op, samples in sorted(per_op.items()):
+        latencies = sorted(seconds for _, seconds in samples)
+        statuses = {}
+        for status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        operations[op] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+            "errors": sum(1 for status, _ in samples if status >= 500),
+            "status_codes": statuses,
+            "mean_ms": round(1000 * sum(latencies) / len(latencies), 3),
+            "p50_ms": round(1000 * percentile(latencies, 50), 3),
+            "p95_ms": round(1000 * percentile(latencies, 95), 3),
+            "p99_ms": round(1000 * percentile(latencies, 99), 3),
+        }
+    return {
+        "requests": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "operations": operations,
+    }
+
+
+def run(app, args):
+    rng = random.Random(args.random_seed)
+    if not args.admission:
+        # every replayed login comes from one client IP
+        admission.settings["ENABLED"] = False
+    with app.app_context():
+        if args.seed:
+            population.seed(args.users, doses=args.doses, reset=args.reset, random_seed=args.random_seed)
+        citizens = db.session.query(func.count(User.id)).filter(User.account_type == "user").scalar()
+        rows = (
+            db.session.query(User.id, User.email, User.token_epoch)
+            .filter(User.account_type == "user")
+            .order_by(User.id)
+            .limit(SAMPLE_USERS)
+            .all()
+        )
+        sample = [
+            (user_id, email, User.generate_auth_token(email, user_id, "user", token_epoch))
+            for user_id, email, token_epoch in rows
+        ]
+        admin = User.find_by_email(population.ADMIN_EMAIL)
+        admin_token = User.generate_auth_token(admin.email, admin.id, admin.account_type, admin.token_epoch)
+        index_report = check_indexes() if args.explain else None
+    if not sample:
+        raise SystemExit("No users to replay traffic for, run with --seed first")
+
+    if args.traffic:
+        requests = list(traffic.load(args.traffic))
+    else:
+        requests = list(traffic.generate(args.mix, args.requests, citizens, rng))
+    replayer = Replayer(app, sample, admin_token, rng)
+    elapsed = replayer.replay(requests, args.concurrency)
+
+    report = {
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "commit": _git_commit(),
+        "database": db.get_engine(app).dialect.name,
+        "users": citizens,
+        "mix": None if args.traffic else args.mix,
+        "traffic_file": args.traffic,
+        "concurrency": args.concurrency,
+    }
+    report.update(summarize(replayer.results, elapsed))
+    if index_report is not None:
+        report["indexes"] = index_report
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output)
+    print(output)
+    return report
@@ -0,0 +1,98 @@
+"""
+Synthetic population seeding for benchmarks.
+Users get realistic dose distributions: most have had a first dose, a share of
+those a second one 4-12 weeks later, vaccines and ages follow rough national
+proportions. Every citizen shares BENCH_PASSWORD so login traffic can be replayed.
+"""
+import datetime
+import logging
+import random
+
+from constants import db
+from models.user import User
+from models.vaccination_summary import VaccinationSummary
+from service.stats import rebuild_summary
+from utils.hashing import hash_password
+
+LOG = logging.getLogger("root")
+
+BENCH_PASSWORD = "benchmark-password"
+ADMIN_EMAIL = "admin@bench.local"
+VACCINES = (("Covishield", 0.8), ("Covaxin", 0.15), ("Sputnik V", 0.05))
+AGE_WEIGHTS = (((18, 44), 0.55), ((45, 59), 0.25), ((60, 95), 0.2))
+FIRST_DOSE_SHARE = 0.75
+SECOND_DOSE_SHARE = 0.7
+CAMPAIGN_START = datetime.date(2021, 1, 16)
+
+
+def citizen_email(index):
+    return "citizen{}@bench.local".format(index)
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def citizen(index, password_hash, rng):
+    low, high = _weighted(rng, AGE_WEIGHTS)
+    values = {
+        "email": citizen_email(index),
+        "password": password_hash,
+        "name": "Citizen {}".format(index),
+        "gender": "Female" if rng.random() < 0.49 else "Male",
+        "age": rng.randint(low, high),
+        "phone_number": "9{:09d}".format(index),
+        "account_type": "user",
+        "vaccine_name": None,
+        "first_doze_taken": "No",
+        "first_doze_date": None,
+        "second_doze_taken": "No",
+        "second_doze_date": None,
+        "is_fully_vaccinated": "No",
+    }
+    if rng.random() < FIRST_DOSE_SHARE:
+        first = CAMPAIGN_START + datetime.timedelta(days=rng.randint(0, 300))
+        values.update(
+            vaccine_name=_weighted(rng, VACCINES),
+            first_doze_taken="Yes",
+            first_doze_date=first,
+        )
+        if rng.random() < SECOND_DOSE_SHARE:
+            values.update(
+                second_doze_taken="Yes",
+                second_doze_date=first + datetime.timedelta(days=rng.randint(28, 84)),
+                is_fully_vaccinated="Yes",
+            )
+    return values
+
+
+def seed(users, batch_size=10000, random_seed=42, doses=False, reset=False):
+    """
+    Creates the tables and inserts an admin plus `users` citizens. Passwords
+    are hashed once and shared, so seeding millions of users stays fast.
+    Expects an empty database unless reset drops every table first.
+    """
+    rng = random.Random(random_seed)
+    if reset:
+        db.drop_all()
+    db.create_all()
+    password_hash = hash_password(BENCH_PASSWORD)
+    admin = citizen(0, password_hash, rng)
+    admin.update(email=ADMIN_EMAIL, name="Bench Admin", account_type="admin")
+    db.session.execute(User.__table__.insert(), [admin])
+    batch = []
+    for index in range(1, users + 1):
+        batch.append(citizen(index, password_hash, rng))
+        if len(batch) == batch_size:
+            db.session.execute(User.__table__.insert(), batch)
+            db.session.commit()
+            batch = []
+            LOG.info("Seeded {} users".format(index))
+    if batch:
+        db.session.execute(User.__table__.insert(), batch)
+    db.session.commit()
+    if doses:
+        User.backfill_doses()
+    if VaccinationSummary.enabled:
+        rebuild_summary()
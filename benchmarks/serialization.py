@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of the list serialization paths of fetch_accounts:
+    1. orm  - ORM objects + to_response_dict + json.dumps (previous path)
+    2. core - Core row tuples + precompiled row serializer (current path)
+Runs against a throw away SQLite database, from the repository root:
+    python -m benchmarks.serialization --rows 10000 100000 1000000
+"""
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+
+from flask import Flask
+
+from constants import db
+from models.user import User
+
+
+def create_app(uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def seed(rows, batch_size=10000):
+    db.drop_all()
+    db.create_all()
+    start = datetime.date(2021, 1, 16)
+    batch = []
+    for i in range(rows):
+        first = start + datetime.timedelta(days=random.randint(0, 300))
+        batch.append({
+            "email": "user{}@example.com".format(i),
+            "password": "x" * 60,
+            "name": "User {}".format(i),
+            "gender": random.choice(("Male", "Female")),
+            "age": random.randint(18, 90),
+            "phone_number": "9{:09d}".format(i),
+            "account_type": "user",
+            "vaccine_name": random.choice(("Covishield", "Covaxin")),
+            "first_doze_taken": "Yes",
+            "first_doze_date": first,
+            "second_doze_taken": "No",
+            "second_doze_date": None,
+            "is_fully_vaccinated": "No",
+        })
+        if len(batch) == batch_size:
+            db.session.execute(User.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(User.__table__.insert(), batch)
+    db.session.commit()
+
+
+def orm_path():
+    body = json.dumps([u.to_response_dict() for u in db.session.query(User).all()])
+    db.session.expunge_all()
+    return body
+
+
+def core_path():
+    serialize = User.row_serializer(User.RESPONSE_FIELDS)
+    return "[" + ",".join([serialize(row) for chunk in User.iter_chunks([]) for row in chunk]) + "]"
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db", default="sqlite:////tmp/vmp_serialization_bench.db")
+    args = parser.parse_args()
+
+    app = create_app(args.db)
+    results = []
+    with app.app_context():
+        for rows in args.rows:
+            seed(rows)
+            assert json.loads(orm_path()) == json.loads(core_path())
+            orm = measure(orm_path, args.repeat)
+            core = measure(core_path, args.repeat)
+            results.append({
+                "rows": rows,
+                "orm_seconds": round(orm, 4),
+                "core_seconds": round(core, 4),
+                "speedup": round(orm / core, 2) if core else None,
+            })
+            print(json.dumps(results[-1]))
+
+
+if __name__ == "__main__":
+    main()
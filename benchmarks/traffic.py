@@ -0,0 +1,138 @@
+"""
+Traffic mixes for the load test.
+A request is a dict {"op", "method", "path", "query", "json", "auth"} where auth
+is "admin", "user" or None. Requests are either generated from a weighted mix
+of operations or replayed from a recorded JSONL file with the same keys; in
+recorded files "{user_id}" in a path is replaced by a random seeded user.
+"""
+import datetime
+import itertools
+import json
+
+from benchmarks.population import BENCH_PASSWORD, citizen_email
+
+MIXES = {
+    "default": {
+        "register": 5,
+        "login": 10,
+        "put_vaccines": 15,
+        "get_vaccines": 45,
+        "get_account": 10,
+        "filtered_list": 12,
+        "stats": 2,
+        "list_all": 1,
+    },
+    "read_heavy": {"get_vaccines": 60, "get_account": 20, "filtered_list": 15, "stats": 5},
+    "write_heavy": {"register": 20, "login": 20, "put_vaccines": 60},
+    "auth": {"register": 30, "login": 70},
+    "admin_lists": {"filtered_list": 70, "stats": 20, "list_all": 10},
+}
+
+_registrations = itertools.count()
+
+
+def _register(users, rng):
+    index = next(_registrations)
+    return {
+        "method": "POST",
+        "path": "/account/register",
+        "json": {
+            "email": "new{}-{}@bench.local".format(index, rng.randint(0, 10 ** 9)),
+            "password": BENCH_PASSWORD,
+            "name": "New citizen {}".format(index),
+            "gender": rng.choice(("Male", "Female")),
+            "age": rng.randint(18, 90),
+            "phone_number": "8{:09d}".format(index),
+            "account_type": "user",
+        },
+    }
+
+
+def _login(users, rng):
+    return {
+        "method": "POST",
+        "path": "/account/login",
+        "json": {"email": citizen_email(rng.randint(1, users)), "password": BENCH_PASSWORD},
+    }
+
+
+def _put_vaccines(users, rng):
+    first = datetime.date(2021, 1, 16) + datetime.timedelta(days=rng.randint(0, 300))
+    return {
+        "method": "PUT",
+        "path": "/vaccines/{user_id}",
+        "json": {
+            "first_doze_taken": "Yes",
+            "first_doze_date": first.isoformat(),
+            "second_doze_taken": "Yes",
+            "second_doze_date": (first + datetime.timedelta(days=rng.randint(28, 84))).isoformat(),
+            "is_fully_vaccinated": "Yes",
+        },
+        "auth": "user",
+    }
+
+
+def _get_vaccines(users, rng):
+    return {"method": "GET", "path": "/vaccines/{user_id}", "auth": "user"}
+
+
+def _get_account(users, rng):
+    return {"method": "GET", "path": "/account/{user_id}", "auth": "user"}
+
+
+def _filtered_list(users, rng):
+    low = rng.choice((18, 30, 45, 60))
+    return {
+        "method": "GET",
+        "path": "/vaccines",
+        "query": {
+            "gender": rng.choice(("Male", "Female")),
+            "age__between": "{},{}".format(low, low + 15),
+            "second_doze_taken": "No",
+            "limit": 100,
+        },
+        "auth": "admin",
+    }
+
+
+def _stats(users, rng):
+    return {"method": "GET", "path": "/vaccines/stats", "auth": "admin"}
+
+
+def _list_all(users, rng):
+    return {"method": "GET", "path": "/vaccines", "query": {"filter": "all"}, "auth": "admin"}
+
+
+OPERATIONS = {
+    "register": _register,
+    "login": _login,
+    "put_vaccines": _put_vaccines,
+    "get_vaccines": _get_vaccines,
+    "get_account": _get_account,
+    "filtered_list": _filtered_list,
+    "stats": _stats,
+    "list_all": _list_all,
+}
+
+
+def generate(mix, count, users, rng):
+    """
+    Yields count requests drawn from the weighted mix
+    """
+    operations, weights = zip(*MIXES[mix].items())
+    for op in rng.choices(operations, weights, k=count):
+        request = OPERATIONS[op](users, rng)
+        request["op"] = op
+        yield request
+
+
+def load(path):
+    """
+    Reads recorded requests from a JSONL file
+    """
+    with open(path) as recorded:
+        for line in recorded:
+            if line.strip():
+                request = json.loads(line)
+                request.setdefault("op", "{} {}".format(request["method"], request["path"]))
+                yield request
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of request validation:
+    1. legacy   - walks the flask-restx model on every request (previous path)
+    2. compiled - CompiledModel built once at decoration time (current path)
+From the repository root: python -m benchmarks.validator --iterations 100000
+"""
+import argparse
+import json
+import time
+
+from flask_restx import Model, fields
+
+from utils.validator import compile_model, type_maps
+
+REGISTER_MODEL = Model(
+    "RegisterController",
+    {
+        "email": fields.String(required=True),
+        "password": fields.String(required=True),
+        "name": fields.String(required=True),
+        "gender": fields.String(required=True),
+        "age": fields.Integer(required=True),
+        "phone_number": fields.String(required=True),
+        "account_type": fields.String(required=True),
+    },
+)
+VACCINATION_MODEL = Model(
+    "VaccinationDataController",
+    {
+        "vaccine_name": fields.String(),
+        "first_doze_taken": fields.String(),
+        "first_doze_date": fields.Date(),
+        "second_doze_taken": fields.String(),
+        "second_doze_date": fields.Date(),
+        "is_fully_vaccinated": fields.String(),
+    },
+)
+PAYLOADS = {
+    "register": (REGISTER_MODEL, {
+        "email": "citizen@example.com",
+        "password": "secret",
+        "name": "Citizen",
+        "gender": "Female",
+        "age": 41,
+        "phone_number": "9000000000",
+        "account_type": "user",
+    }),
+    "vaccination": (VACCINATION_MODEL, {
+        "first_doze_taken": "Yes",
+        "first_doze_date": "2021-05-01",
+        "second_doze_taken": "No",
+    }),
+}
+
+
+def legacy_validate(params, payload):
+    json_obj = {}
+    json_obj.update(payload)
+    missing = [r for r in params.keys() if params[r].required and r not in json_obj]
+    if missing:
+        return {"message": "payload missing required params", "missing": ",".join(missing)}
+    wrong_types = [
+        r for r in params.keys()
+        if params[r].required
+        and not isinstance(json_obj[r], type_maps.get(params[r].__schema_type__))
+    ]
+    if wrong_types:
+        return {
+            "message": "payload type error",
+            "param_types": {k: str(params[k].__schema_type__) for k in params.keys()},
+        }
+    return {}
+
+
+def measure(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+    for name, (model, payload) in PAYLOADS.items():
+        compiled = compile_model(model)
+        legacy = measure(lambda: legacy_validate(model, payload), args.iterations)
+        current = measure(lambda: compiled.validate(dict(payload)), args.iterations)
+        print(json.dumps({
+            "payload": name,
+            "legacy_us": round(legacy * 1e6, 3),
+            "compiled_us": round(current * 1e6, 3),
+            "speedup": round(legacy / current, 2) if current else None,
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,16 @@
 """
 Utils script containing commmon constants required across modules
 """
+import datetime
 import os
 import re
 
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
 
+from utils.replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+
+db = RoutingSQLAlchemy()
 bcrypt = Bcrypt()
 CWD = os.getcwd()
 PROTECTED_PATH = "{}/app/preview/protected".format(CWD)
@@ -16,4 +18,19 @@ ADD_MODELS = "sed -ie 's/# from myapp import mymodel/from app.models import {}/g
 REQUEST_TIMEOUT = 120
 LOG_CAPACITY = 100
 BASE_HEADERS = {"access-control-allow-origin": "*"}
-EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
\ No newline at end of file
+EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
+FETCH_CHUNK_SIZE = 1000
+MAX_PAGE_LIMIT = 1000
+IMPORT_BATCH_SIZE = 1000
+BATCH_UPDATE_CHUNK_SIZE = 1000
+# Upper bound (exclusive) and label of every age band used by the coverage statistics
+AGE_BANDS = ((18, "0-17"), (45, "18-44"), (60, "45-59"), (None, "60+"))
+BACKFILL_CHUNK_SIZE = 1000
+MAX_FILTER_PREDICATES = 50
+MAX_FILTER_VALUES = 1000
+# Margin for clock differences between the servers stamping updated_at, the
+# incremental scans of updated_at re-read this much before their last run
+CLOCK_SKEW = datetime.timedelta(seconds=30)
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_GZIP_LEVEL = 6
+PURGE_BATCH_SIZE = 500
@@ -3,8 +3,11 @@ Controller for performing following operations:
     1. Registering a new user
     2. Logging into existing user accounts
     3. CRUD operations on user accounts
+    4. Registering accounts in bulk from CSV / JSONL uploads
+    5. Searching accounts by name, email or phone number
 """
 # Builtin imports
+from flask import request
 from flask_restx import Namespace, Resource, fields
 
 # Custom imports
@@ -14,7 +17,10 @@ from service.account import (
     modify,
     fetch_object,
     delete,
+    search_accounts,
 )
+from service.bulk import bulk_import
+from utils.admission import admission_control
 from utils.decorators import decode_auth_token
 from utils.validator import validate_params
 
@@ -60,7 +66,18 @@ account_filter = account_ns.model(
     "FilterController",
     {
         "filter": fields.String(), 
-        "auth": fields.String()
+        "auth": fields.String(),
+        "fields": fields.String(),
+    },
+)
+
+account_search_model = account_ns.model(
+    "SearchController",
+    {
+        "q": fields.String(required=True),
+        "limit": fields.Integer(),
+        "offset": fields.Integer(),
+        "fields": fields.String(),
     },
 )
 
@@ -76,6 +93,7 @@ delete_account_model = account_ns.model(
 class RegistrationController(Resource):
     @account_ns.expect(account_register_model, validate=False)
     @validate_params(account_register_model)
+    @admission_control("register")
     def post(self, *args, **kwargs):
         """
         Registers a new account with a unique email.
@@ -88,6 +106,7 @@ class RegistrationController(Resource):
 class LoginController(Resource):
     @account_ns.expect(account_login_model, validate=False)
     @validate_params(account_login_model)
+    @admission_control("login")
     def post(self, *args, **kwargs):
         """
         Login the user with email and password coming encrypted from FE.
@@ -96,6 +115,42 @@ class LoginController(Resource):
         return response
 
 
+@account_ns.route("/bulk")
+class BulkImportController(Resource):
+    @decode_auth_token
+    def post(self, *args, **kwargs):
+        """
+        Registers accounts from an uploaded CSV or JSONL file, admin only.
+        The file is sent as multipart field "file" or as the raw request body.
+        """
+        upload = request.files.get("file")
+        if upload is not None:
+            stream, filename, mimetype = upload.stream, upload.filename, upload.mimetype
+        else:
+            stream, filename, mimetype = request.stream, None, request.mimetype
+        response = bulk_import(
+            details=kwargs,
+            stream=stream,
+            filename=filename,
+            mimetype=mimetype,
+            requested_format=request.args.get("format"),
+        )
+        return response
+
+
+@account_ns.route("/search")
+class SearchController(Resource):
+    @account_ns.expect(account_search_model, validate=False)
+    @validate_params(account_search_model)
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Ranked fuzzy search of accounts by name, email or phone number, admin only
+        """
+        response = search_accounts(kwargs)
+        return response
+
+
 @account_ns.route("/<int:ac_id>")
 class ModificationController(Resource):
     @account_ns.expect(account_modify_model, validate=False)
@@ -125,5 +180,7 @@ class ModificationController(Resource):
         """
         Fetch the account details
         """
-        response = fetch_object(params={"id":kwargs.get("id")})
+        response = fetch_object(
+            kwargs={"id": kwargs.get("id"), "fields": kwargs.get("params", {}).get("fields")}
+        )
         return response
\ No newline at end of file
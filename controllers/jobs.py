@@ -0,0 +1,81 @@
+"""
+Controller for performing following operations: 
+    1. Queueing long running admin jobs (coverage recomputation, exports)
+    2. Queueing the import of an uploaded CSV / JSONL file of accounts
+    3. Fetching the status, progress and result of a job
+    4. Downloading the file written by an export job
+"""
+# Builtin imports
+from flask import request
+from flask_restx import Namespace, Resource, fields
+
+# Custom imports
+from service.jobs import create_import_job, create_job, download_job_file, fetch_job
+from utils.decorators import decode_auth_token
+
+jobs_ns = Namespace("jobs")
+
+job_model = jobs_ns.model(
+    "JobController",
+    {
+        "type": fields.String(required=True, enum=["recompute_stats", "export"]),
+        "params": fields.Raw(),
+    },
+)
+
+
+@jobs_ns.route("")
+class JobController(Resource):
+    @jobs_ns.expect(job_model, validate=False)
+    @decode_auth_token
+    def post(self, *args, **kwargs):
+        """
+        Queue a job, admin only. Returns 202 with the job id.
+        """
+        response = create_job(details=kwargs, body=request.get_json(silent=True))
+        return response
+
+
+@jobs_ns.route("/import")
+class ImportJobController(Resource):
+    @decode_auth_token
+    def post(self, *args, **kwargs):
+        """
+        Queue the import of an uploaded CSV or JSONL file of accounts, admin only.
+        The file is sent as multipart field "file" or as the raw request body.
+        """
+        upload = request.files.get("file")
+        if upload is not None:
+            stream, filename, mimetype = upload.stream, upload.filename, upload.mimetype
+        else:
+            stream, filename, mimetype = request.stream, None, request.mimetype
+        response = create_import_job(
+            details=kwargs,
+            stream=stream,
+            filename=filename,
+            mimetype=mimetype,
+            requested_format=request.args.get("format"),
+        )
+        return response
+
+
+@jobs_ns.route("/<int:job_id>")
+class JobStatusController(Resource):
+    @decode_auth_token
+    def get(self, job_id, **kwargs):
+        """
+        Fetch the status, progress and result of a job
+        """
+        response = fetch_job(details=kwargs, job_id=job_id)
+        return response
+
+
+@jobs_ns.route("/<int:job_id>/download")
+class JobDownloadController(Resource):
+    @decode_auth_token
+    def get(self, job_id, **kwargs):
+        """
+        Download the file written by a succeeded export job
+        """
+        response = download_job_file(details=kwargs, job_id=job_id)
+        return response
@@ -0,0 +1,48 @@
+"""
+Controller for performing following operations: 
+    1. Exposing user cache statistics to admins
+    2. Exposing database connection pool statistics to admins
+    3. Exposing all metrics in the Prometheus text format on /metrics
+"""
+# Builtin imports
+from flask_restx import Namespace, Resource
+
+# Custom imports
+from service.monitoring import cache_stats, exposition, pool_stats
+from utils.decorators import decode_auth_token
+
+monitoring_ns = Namespace("monitoring")
+metrics_ns = Namespace("metrics")
+
+
+@monitoring_ns.route("/cache")
+class CacheStatsController(Resource):
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Fetch hit/miss counters of the user cache
+        """
+        response = cache_stats(kwargs)
+        return response
+
+
+@monitoring_ns.route("/pool")
+class PoolStatsController(Resource):
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Fetch live statistics of the database connection pool
+        """
+        response = pool_stats(kwargs)
+        return response
+
+
+@metrics_ns.route("")
+class MetricsController(Resource):
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Fetch latency, status code, SQL, bcrypt and JWT metrics in the Prometheus text format
+        """
+        response = exposition(kwargs)
+        return response
@@ -3,9 +3,13 @@ Controller for performing following operations:
     1. Modifying Vaccination details
     2. Fetching vaccination data for a single user
     3. Fetching vaccination data for multiple users
-    4. Filtering data based on: Gender [Male/Female], is_fully_vaccinated, first_doze_taken, second_doze_taken
+    4. Filtering data with AND/OR, range, IN-list and date range predicates over User columns
+    5. Modifying vaccination details of many users in one batch
+    6. Vaccination coverage statistics
+    7. Streaming CSV / JSONL / columnar exports of vaccination data
 """
 # Builtin imports
+from flask import request
 from flask_restx import Namespace, Resource, fields
 
 # Custom imports
@@ -15,14 +19,18 @@ from service.account import (
     fetch_accounts,
     delete,
 )
+from service.bulk import batch_update_vaccinations
+from service.export import export_vaccinations
+from service.stats import vaccination_stats
 from utils.decorators import decode_auth_token
-from utils.validator import validate_params
+from utils.validator import compile_model, validate_params
 
 vaccination_ns = Namespace("vaccines")
 
 vaccination_details_model = vaccination_ns.model(
     "VaccinationDataController",
     {
+        "vaccine_name": fields.String(),
         "first_doze_taken": fields.String(),
         "first_doze_date": fields.Date(),
         "second_doze_taken": fields.String(),
@@ -31,14 +39,83 @@ vaccination_details_model = vaccination_ns.model(
     }
 )
 
+vaccination_batch_item_model = vaccination_ns.clone(
+    "VaccinationBatchItem",
+    vaccination_details_model,
+    {"ac_id": fields.Integer(required=True)},
+)
+batch_item_validator = compile_model(vaccination_batch_item_model, check_optional=True, strict=True)
+
 vaccine_data_filter_model = vaccination_ns.model(
     "RetrievalController",
     {
         "filter": fields.String(), 
+        "value": fields.String(),
         "auth": fields.String(), 
+        "limit": fields.Integer(),
+        "after": fields.Integer(),
+        "offset": fields.Integer(),
+        "sort": fields.String(),
+        "count_only": fields.Boolean(),
+        "where": fields.Raw(),
+        "fields": fields.String(),
     },
 )
 
+vaccine_data_export_model = vaccination_ns.model(
+    "ExportController",
+    {
+        "format": fields.String(enum=["csv", "jsonl", "columnar"]),
+        "gzip": fields.Boolean(),
+        "filter": fields.String(),
+        "value": fields.String(),
+        "auth": fields.String(),
+        "sort": fields.String(),
+        "where": fields.Raw(),
+        "fields": fields.String(),
+    },
+)
+
+
+@vaccination_ns.route("/batch")
+class BatchVaccinationDataController(Resource):
+    @decode_auth_token
+    def put(self, *args, **kwargs):
+        """
+        Modify vaccination details for a list of user accounts, admin only.
+        Body is a list (or {"items": [...]}) of {"ac_id": ..., <vaccination details>}
+        """
+        response = batch_update_vaccinations(
+            details=kwargs,
+            items=request.get_json(silent=True),
+            validator=batch_item_validator,
+        )
+        return response
+
+
+@vaccination_ns.route("/stats")
+class VaccinationStatsController(Resource):
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Fetch vaccination coverage counts, admin only
+        """
+        response = vaccination_stats(kwargs)
+        return response
+
+
+@vaccination_ns.route("/export")
+class ExportController(Resource):
+    @vaccination_ns.expect(vaccine_data_export_model, validate=False)
+    @validate_params(vaccine_data_export_model)
+    @decode_auth_token
+    def get(self, *args, **kwargs):
+        """
+        Stream users' vaccination data as a CSV, JSONL or columnar file, admin only
+        """
+        response = export_vaccinations(kwargs)
+        return response
+
 
 @vaccination_ns.route("/<int:ac_id>")
 class VaccinationDataController(Resource):
@@ -58,6 +135,7 @@ class VaccinationDataController(Resource):
         Fetch vaccination data for a single user account
         """
         kwargs["vaccine_data"] = True
+        kwargs["fields"] = request.args.get("fields")
         response = fetch_object(kwargs)
         return response
 
@@ -0,0 +1,63 @@
+import os, sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+from constants import db
+
+# Doses mirrored from the legacy User dose columns, later doses (boosters) only live in Dose
+LEGACY_DOSE_NUMBERS = (1, 2)
+# Free text values of the legacy User dose columns that mean "taken"
+TAKEN_VALUES = {"yes", "y", "true", "1", "taken", "done"}
+
+
+def is_taken(value):
+    return value is not None and str(value).strip().lower() in TAKEN_VALUES
+
+
+def doses_from_user(values):
+    """
+    Derives the dose rows and the fully vaccinated flag of a user from its
+    legacy User dose columns
+    """
+    doses = []
+    slots = (
+        (1, values.get("first_doze_taken"), values.get("first_doze_date")),
+        (2, values.get("second_doze_taken"), values.get("second_doze_date")),
+    )
+    for dose_number, taken, taken_on in slots:
+        if is_taken(taken) or taken_on is not None:
+            doses.append({
+                "user_id": values["id"],
+                "dose_number": dose_number,
+                "vaccine": values.get("vaccine_name"),
+                "date": taken_on,
+            })
+    if values.get("is_fully_vaccinated") is not None:
+        fully_vaccinated = is_taken(values.get("is_fully_vaccinated"))
+    else:
+        fully_vaccinated = any(dose["dose_number"] == 2 for dose in doses)
+    return doses, fully_vaccinated
+
+
+class Dose(db.Model):
+    """
+    One administered dose of a user, any number of doses per user (boosters
+    included). Written alongside the legacy User dose columns.
+    """
+    __tablename__ = "Dose"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("User.id", ondelete="CASCADE"), nullable=False)
+    dose_number = db.Column(db.SmallInteger, nullable=False)
+    vaccine = db.Column(db.String(100))
+    date = db.Column(db.Date)
+
+    __table_args__ = (
+        db.UniqueConstraint(user_id, dose_number, name="uq_dose_user_dose_number"),
+    )
+
+    def to_response_dict(self):
+        return {
+            "dose_number": self.dose_number,
+            "vaccine": self.vaccine,
+            "date": self.date.isoformat() if self.date else None,
+        }
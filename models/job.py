@@ -0,0 +1,198 @@
+import datetime
+import json
+
+from sqlalchemy import and_, func, or_, select
+
+import os, sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+from constants import db
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+# pg_advisory_xact_lock key serializing the claims of every process
+CLAIM_LOCK_ID = 7270301
+
+
+class Job(db.Model):
+    """
+    A long running admin operation queued in the database. Any process
+    running a job worker claims queued jobs with FOR UPDATE SKIP LOCKED, so
+    the queue is shared by every server / worker process.
+    """
+    __tablename__ = "Job"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    params = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    run_after = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed by the running worker, a stale heartbeat means the worker died
+    heartbeat_at = db.Column(db.DateTime)
+    worker = db.Column(db.String(100))
+
+    # Only unfinished jobs are ever scanned by the workers
+    __table_args__ = (
+        db.Index(
+            "ix_job_status_run_after",
+            status,
+            run_after,
+            postgresql_where=status.in_([QUEUED, RUNNING]),
+            sqlite_where=status.in_([QUEUED, RUNNING]),
+        ),
+    )
+
+    def to_response_dict(self):
+        resp_dict = {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "progress": self.progress,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "params": json.loads(self.params) if self.params else {},
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+        }
+        for column in ("created_at", "started_at", "finished_at"):
+            value = getattr(self, column)
+            resp_dict[column] = value.isoformat() if value else None
+        return resp_dict
+
+    @staticmethod
+    def enqueue(job_type, params, created_by=None, max_attempts=1):
+        """
+        Queues a job and commits, returns it
+        """
+        job = Job(
+            type=job_type,
+            status=QUEUED,
+            params=json.dumps(params or {}),
+            created_by=created_by,
+            max_attempts=max_attempts,
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def claim(limits, worker, stale_after):
+        """
+        Marks the oldest runnable job as running and commits, returns it or
+        None. limits maps the job types to claim to the number of jobs of the
+        type allowed to run at once across all processes. Running jobs whose
+        heartbeat is older than stale_after (a timedelta) were abandoned by a
+        dead worker and are claimed again, or failed once they used up
+        max_attempts.
+        """
+        if not limits:
+            return None
+        if db.session.get_bind().dialect.name == "postgresql":
+            # counting the running jobs and claiming must not interleave between processes
+            db.session.execute(select([func.pg_advisory_xact_lock(CLAIM_LOCK_ID)]))
+        now = datetime.datetime.utcnow()
+        abandoned = and_(Job.status == RUNNING, Job.heartbeat_at < now - stale_after)
+        # jobs that took their worker down on every attempt are not retried forever
+        db.session.query(Job).filter(abandoned, Job.attempts >= Job.max_attempts).update(
+            {"status": FAILED, "finished_at": now, "error": "worker lost"}, synchronize_session=False
+        )
+        running = dict(
+            db.session.query(Job.type, func.count(Job.id))
+            .filter(Job.status == RUNNING, Job.heartbeat_at >= now - stale_after)
+            .group_by(Job.type)
+        )
+        job_types = [job_type for job_type, limit in limits.items() if running.get(job_type, 0) < limit]
+        if not job_types:
+            db.session.commit()
+            return None
+        job = (
+            db.session.query(Job)
+            .filter(Job.type.in_(job_types))
+            .filter(or_(
+                and_(Job.status == QUEUED, Job.run_after <= now),
+                and_(abandoned, Job.attempts < Job.max_attempts),
+            ))
+            .order_by(Job.run_after, Job.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            db.session.commit()
+            return None
+        job.status = RUNNING
+        job.attempts += 1
+        job.worker = worker
+        job.started_at = job.heartbeat_at = now
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def _attempt(job_id, worker, attempt):
+        """
+        Criterion of one attempt of a job, still running on the worker that claimed it
+        """
+        return and_(Job.id == job_id, Job.status == RUNNING, Job.worker == worker, Job.attempts == attempt)
+
+    @staticmethod
+    def heartbeat(job_id, worker, attempt, progress=None):
+        """
+        Refreshes the heartbeat (and progress) of an attempt on its own
+        connection, outside the transaction of the job itself. Returns False
+        when the attempt was superseded, i.e. the job was claimed again.
+        """
+        values = {"heartbeat_at": datetime.datetime.utcnow()}
+        if progress is not None:
+            values["progress"] = max(0, min(100, int(progress)))
+        table = Job.__table__
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                table.update().where(Job._attempt(job_id, worker, attempt)).values(**values)
+            )
+        return result.rowcount > 0
+
+    @staticmethod
+    def checkpoint(job_id, worker, attempt, state):
+        """
+        Stores the state a later attempt resumes from as the result of the
+        job, inside the session transaction so it commits along with the work
+        it describes. Returns False when the attempt was superseded.
+        """
+        table = Job.__table__
+        result = db.session.execute(
+            table.update().where(Job._attempt(job_id, worker, attempt)).values(result=json.dumps(state))
+        )
+        return result.rowcount > 0
+
+    @staticmethod
+    def finish(job_id, worker, attempt, result=None, error=None, retry_in=None):
+        """
+        Records the outcome of an attempt: succeeded, queued again after
+        retry_in (a timedelta) or failed. Superseded attempts record nothing
+        and get None.
+        """
+        now = datetime.datetime.utcnow()
+        job = db.session.query(Job).filter(Job._attempt(job_id, worker, attempt)).with_for_update().first()
+        if job is None:
+            db.session.commit()
+            return None
+        if error is None:
+            job.status, job.progress, job.result = SUCCEEDED, 100, json.dumps(result)
+            job.finished_at = now
+        elif retry_in is not None and job.attempts < job.max_attempts:
+            job.status, job.run_after = QUEUED, now + retry_in
+        else:
+            job.status, job.finished_at = FAILED, now
+        job.error = error
+        db.session.commit()
+        return job
@@ -1,25 +1,37 @@
 import datetime
 import json
+import time
 import uuid
 
 import glog as log
 import jwt
 from flask import jsonify
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String
+from sqlalchemy import Column, DDL, String, and_, bindparam, case, event, func, or_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import make_transient_to_detached
 
 import os, sys
 currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
-from constants import db
+from constants import db, AGE_BANDS, BACKFILL_CHUNK_SIZE, FETCH_CHUNK_SIZE, PURGE_BATCH_SIZE
+from models.dose import Dose, LEGACY_DOSE_NUMBERS, doses_from_user
+from models.vaccination_summary import GROUP_COLUMNS, SOURCE_COLUMNS, VaccinationSummary
+from utils.cache import CacheStats, create_cache
+from utils.filters import to_bool, to_date
+from utils import http_cache, replicas
+from utils.hashing import hash_password
+from utils.serializers import row_serializer
+from utils.search import SearchIndex
+from utils.token_epochs import EpochTable
 
 
 class User(db.Model):
     __tablename__ = "User"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    email = db.Column(db.String(254), unique=True)
+    # unique among live users only, see uq_user_email_live
+    email = db.Column(db.String(254))
     password = db.Column(db.String(100))
     name = db.Column(db.String(100))
     gender = db.Column(db.String(100))
@@ -32,6 +44,175 @@ class User(db.Model):
     second_doze_taken = db.Column(db.String())
     second_doze_date = db.Column(db.Date) 
     is_fully_vaccinated = db.Column(db.String())
+    # Bumped by every write, versions the row for ETags
+    updated_at = db.Column(
+        db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+    # Bumped to revoke every auth token issued before, see utils.token_epochs
+    token_epoch = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Derived from the doses, maintained by sync_doses
+    fully_vaccinated = db.Column(db.Boolean, index=True)
+    # Tombstone of a deleted user, purged after the retention period by purge_deleted
+    deleted_at = db.Column(db.DateTime)
+
+    # (filter column, id) indexes serve both the equality filters of fetch_accounts
+    # and the id ordered keyset pages; dose dates are mostly NULL so only taken doses are indexed.
+    # Reads never see tombstones, so the filter indexes only cover live users and
+    # the deleted_at index only covers tombstones.
+    __table_args__ = (
+        db.Index("ix_user_updated_at", updated_at),
+        db.Index(
+            "uq_user_email_live",
+            email,
+            unique=True,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None),
+            sqlite_where=deleted_at.isnot(None),
+        ),
+        db.Index(
+            "ix_user_gender_id",
+            gender,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_age_id",
+            age,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_is_fully_vaccinated_id",
+            is_fully_vaccinated,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_first_doze_taken_id",
+            first_doze_taken,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_second_doze_taken_id",
+            second_doze_taken,
+            id,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_first_doze_date_id",
+            first_doze_date,
+            id,
+            postgresql_where=and_(first_doze_date.isnot(None), deleted_at.is_(None)),
+            sqlite_where=and_(first_doze_date.isnot(None), deleted_at.is_(None)),
+        ),
+        db.Index(
+            "ix_user_second_doze_date_id",
+            second_doze_date,
+            id,
+            postgresql_where=and_(second_doze_date.isnot(None), deleted_at.is_(None)),
+            sqlite_where=and_(second_doze_date.isnot(None), deleted_at.is_(None)),
+        ),
+        # pg_trgm indexes of the search, plain partial indexes on other databases
+        db.Index(
+            "ix_user_name_trgm",
+            name,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_email_trgm",
+            email,
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        db.Index(
+            "ix_user_phone_number_trgm",
+            phone_number,
+            postgresql_using="gin",
+            postgresql_ops={"phone_number": "gin_trgm_ops"},
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+    )
+
+    # Legacy columns the Dose rows are derived from
+    DOSE_COLUMNS = (
+        "vaccine_name",
+        "first_doze_taken",
+        "first_doze_date",
+        "second_doze_taken",
+        "second_doze_date",
+        "is_fully_vaccinated",
+    )
+
+    # Keys of to_response_dict, in order, and the vaccination subset of them
+    RESPONSE_FIELDS = (
+        "id",
+        "email",
+        "name",
+        "gender",
+        "age",
+        "phone_number",
+        "vaccine_name",
+        "first_doze_taken",
+        "first_doze_date",
+        "second_doze_taken",
+        "second_doze_date",
+        "is_fully_vaccinated",
+        "account_type",
+    )
+    VACCINE_FIELDS = (
+        "vaccine_name",
+        "first_doze_taken",
+        "first_doze_date",
+        "second_doze_taken",
+        "second_doze_date",
+        "is_fully_vaccinated",
+    )
+    ACCOUNT_FIELDS = ("id", "email", "name", "gender", "age", "phone_number", "account_type")
+
+    # Columns that can be filtered and sorted on when listing users
+    FILTER_FIELDS = {
+        "id": int,
+        "email": str,
+        "name": str,
+        "gender": str,
+        "age": int,
+        "phone_number": str,
+        "account_type": str,
+        "vaccine_name": str,
+        "first_doze_taken": str,
+        "first_doze_date": to_date,
+        "second_doze_taken": str,
+        "second_doze_date": to_date,
+        "is_fully_vaccinated": str,
+        "fully_vaccinated": to_bool,
+    }
+
+    # Columns matched by the search
+    SEARCH_COLUMNS = ("name", "email", "phone_number")
+
+    # Changing any of these revokes the tokens of the user
+    TOKEN_REVOKING_COLUMNS = ("email", "password", "account_type")
+
+    # Read-through cache of user rows, keyed "id:<id>" -> row and "email:<email>" -> id
+    cache = None
+    cache_stats = CacheStats()
 
     def __init__(self, user_data=None):
         if not user_data:
@@ -49,7 +230,7 @@ class User(db.Model):
         self.is_fully_vaccinated = user_data.get("is_fully_vaccinated")
         self.account_type = user_data.get("account_type")
         if user_data.get("password"):
-            self.password = Bcrypt().generate_password_hash(user_data.get("password")).decode()
+            self.password = hash_password(user_data.get("password"))
 
     def to_response_dict(self):
         """
@@ -72,14 +253,119 @@ class User(db.Model):
         }
         return resp_dict
 
+    @staticmethod
+    def project(fields, values):
+        """
+        Builds the response dict of the given fields from a row tuple or a
+        column dict, same formatting as to_response_dict
+        """
+        if not isinstance(values, dict):
+            values = dict(zip(values.keys(), values))
+        resp_dict = {}
+        for field in fields:
+            value = values.get(field)
+            resp_dict[field] = value.isoformat() if isinstance(value, datetime.date) else value
+        return resp_dict
+
+    @staticmethod
+    def fetch_fields(params, fields):
+        """
+        Fetches only the given response fields of the first user matching params.
+        Goes through the user cache when it is enabled.
+        """
+        if User.cache is not None:
+            user_object = User.fetch_user(params)
+            return User.project(fields, user_object._to_cache_dict()) if user_object else None
+        columns = [getattr(User, field) for field in fields]
+        row = db.session.query(*columns).filter_by(**params).filter(User.live()).first()
+        return User.project(fields, row) if row else None
+
+    @staticmethod
+    def configure_cache(config):
+        """
+        Sets up the user cache backend from the USER_CACHE config section
+        """
+        User.cache = create_cache(config)
+        User.cache_stats = CacheStats()
+
+    def _to_cache_dict(self):
+        # the password hash stays out of the shared cache, authentication never reads it from there
+        data = {
+            column.name: getattr(self, column.name) for column in User.__table__.columns if column.name != "password"
+        }
+        for key, value in data.items():
+            if isinstance(value, datetime.date):
+                data[key] = value.isoformat()
+        return data
+
+    @staticmethod
+    def _from_cache_dict(data):
+        """
+        Rebuilds a user from its cached row and attaches it to the session without a SELECT
+        """
+        user_obj = User()
+        columns = User.__table__.columns
+        for key, value in data.items():
+            if value and isinstance(columns[key].type, db.DateTime):
+                value = datetime.datetime.fromisoformat(value)
+            elif value and isinstance(columns[key].type, db.Date):
+                value = datetime.date.fromisoformat(value)
+            setattr(user_obj, key, value)
+        make_transient_to_detached(user_obj)
+        return db.session.merge(user_obj, load=False)
+
+    @staticmethod
+    def _cached(key):
+        if User.cache is None:
+            return None
+        if key.startswith("email:"):
+            user_id = User.cache.get(key)
+            data = User.cache.get("id:{}".format(user_id)) if user_id is not None else None
+            if data and "email:{}".format(data.get("email")) != key:
+                data = None
+        else:
+            data = User.cache.get(key)
+        User.cache_stats.record(data is not None)
+        return User._from_cache_dict(data) if data else None
+
+    def _store_in_cache(self):
+        if User.cache is None:
+            return
+        User.cache.set("id:{}".format(self.id), self._to_cache_dict())
+        User.cache.set("email:{}".format(self.email), self.id)
+
+    @staticmethod
+    def invalidate_cache(filter_param=None):
+        """
+        Drops cached rows and responses affected by a write. Writes filtered by
+        anything other than the id clear the whole caches.
+        """
+        by_id = filter_param and set(filter_param) == {"id"}
+        http_cache.invalidate(filter_param["id"] if by_id else None)
+        if User.cache is None:
+            return
+        if by_id:
+            User.cache.delete("id:{}".format(filter_param["id"]))
+        else:
+            User.cache.clear()
+
     @staticmethod
     def fetch_user(params):
         """
         Fetches user data from database based on provided params
         """
         try:
-            user_object = db.session.query(User).filter_by(**params).first()
+            by_id = set(params) == {"id"}
+            if by_id:
+                user_object = User._cached("id:{}".format(params["id"]))
+                if user_object:
+                    return user_object
+            # a row cached from a lagging replica would outlive the write it missed
+            with replicas.on_primary(by_id and User.cache is not None):
+                user_object = db.session.query(User).filter_by(**params).filter(User.live()).first()
             if user_object:
+                if by_id:
+                    user_object._store_in_cache()
                 return user_object
         except Exception as e:
             log.info(e, exc_info=True)
@@ -92,22 +378,292 @@ class User(db.Model):
         """
         try:
             if params.get("filter") == "all":
-                user_objects = db.session.query(User).all()
+                user_objects = db.session.query(User).filter(User.live()).all()
             else:
-                user_objects = db.session.query(User).filter_by(**params).all()
+                user_objects = db.session.query(User).filter_by(**params).filter(User.live()).all()
             if user_objects:
-                for user_object in user_objects:
-                    user_object = user_object.to_response_dict()
                 return user_objects
         except Exception as e:
             log.info(e, exc_info=True)
             return False
 
+    @staticmethod
+    def fetch_page(criteria, limit, after=None, order=None, offset=None, fields=RESPONSE_FIELDS):
+        """
+        Fetches one page of plain row tuples (id plus the given fields, see
+        row_columns) of users matching all criteria, bypassing the ORM. Pages in
+        the default id order are keyset based (after = last id seen), custom
+        orders use offset.
+        """
+        statement = User._select(fields, criteria)
+        if order is None:
+            if after is not None:
+                statement = statement.where(User.id > after)
+            statement = statement.order_by(User.id)
+        else:
+            statement = statement.order_by(*order).offset(offset)
+        return db.session.execute(statement.limit(limit)).fetchall()
+
+    @staticmethod
+    def iter_chunks(criteria, order=None, chunk_size=FETCH_CHUNK_SIZE, fields=RESPONSE_FIELDS):
+        """
+        Yields row tuples (id plus the given fields) of users matching all
+        criteria in chunks, so callers never hold the complete result set in
+        memory. The default id order walks keyset pages, custom orders stream a
+        single server side cursor.
+        """
+        if order is not None:
+            statement = (
+                User._select(fields, criteria)
+                .order_by(*order)
+                .execution_options(stream_results=True)
+            )
+            result = db.session.execute(statement)
+            while True:
+                chunk = result.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        after = None
+        while True:
+            chunk = User.fetch_page(criteria, chunk_size, after, fields=fields)
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after = chunk[-1].id
+
+    @staticmethod
+    def row_columns(fields):
+        """
+        Names of the values of the row tuples fetched for the given fields
+        """
+        return ("id",) + tuple(field for field in fields if field != "id")
+
+    @staticmethod
+    def _columns(fields):
+        return [getattr(User, column) for column in User.row_columns(fields)]
+
+    @staticmethod
+    def live():
+        """
+        Criterion excluding soft deleted users, part of every read
+        """
+        return User.deleted_at.is_(None)
+
+    @staticmethod
+    def _select(fields, criteria):
+        return select(User._columns(fields)).where(and_(User.live(), *criteria))
+
+    @staticmethod
+    def row_serializer(fields):
+        """
+        Precompiled JSON writer of the row tuples fetched for the given fields
+        """
+        return row_serializer(User.__table__, User.row_columns(fields), tuple(fields))
+
+    @staticmethod
+    def count(criteria):
+        """
+        Counts users matching all criteria without loading any row
+        """
+        return db.session.query(func.count(User.id)).filter(User.live(), *criteria).scalar()
+
+    def summary_values(self):
+        """
+        Returns the column values the coverage summary groups are derived from
+        """
+        return {column: getattr(self, column) for column in SOURCE_COLUMNS}
+
+    @staticmethod
+    def age_band_expression():
+        whens = [(User.age.is_(None), "")]
+        whens += [(User.age < upper, label) for upper, label in AGE_BANDS if upper is not None]
+        return case(whens, else_=AGE_BANDS[-1][1])
+
+    @staticmethod
+    def grouped_counts():
+        """
+        Counts users per coverage summary group with a single GROUP BY
+        """
+        columns = [
+            User.age_band_expression() if column == "age_band" else getattr(User, column)
+            for column in GROUP_COLUMNS
+        ]
+        rows = db.session.query(*columns, func.count(User.id)).filter(User.live()).group_by(*columns)
+        return {
+            tuple("" if value is None else str(value) for value in row[:-1]): row[-1]
+            for row in rows
+        }
+
+    @staticmethod
+    def sync_doses(user_ids):
+        """
+        Rewrites doses 1 and 2 and the fully_vaccinated flag of the given users
+        from their dose columns, in the current transaction. Later doses are
+        kept. The caller commits.
+        """
+        if not user_ids:
+            return
+        columns = [User.id] + [getattr(User, column) for column in User.DOSE_COLUMNS]
+        rows = db.session.query(*columns).filter(User.id.in_(user_ids)).all()
+        doses, flags = [], []
+        for row in rows:
+            user_doses, fully_vaccinated = doses_from_user(row._asdict())
+            doses.extend(user_doses)
+            flags.append({"b_id": row.id, "b_fully_vaccinated": fully_vaccinated})
+        db.session.query(Dose).filter(
+            Dose.user_id.in_(user_ids), Dose.dose_number.in_(LEGACY_DOSE_NUMBERS)
+        ).delete(synchronize_session=False)
+        if doses:
+            db.session.execute(Dose.__table__.insert(), doses)
+        if flags:
+            table = User.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.id == bindparam("b_id"))
+                .values(fully_vaccinated=bindparam("b_fully_vaccinated")),
+                flags,
+            )
+
+    @staticmethod
+    def backfill_doses(chunk_size=BACKFILL_CHUNK_SIZE):
+        """
+        Populates Dose for every existing user, one short transaction per id
+        ordered chunk so the User table is never locked for long. Safe to re-run.
+        """
+        after, synced = 0, 0
+        while True:
+            ids = [
+                user_id for (user_id,) in db.session.query(User.id)
+                .filter(User.id > after, User.live())
+                .order_by(User.id)
+                .limit(chunk_size)
+            ]
+            if not ids:
+                break
+            User.sync_doses(ids)
+            db.session.commit()
+            synced += len(ids)
+            after = ids[-1]
+            log.info("Backfilled doses of {} users".format(synced))
+        return synced
+
+    @staticmethod
+    def load_search_rows(since=None, after_id=0, chunk_size=FETCH_CHUNK_SIZE):
+        """
+        Yields chunks of (id, search columns, deleted_at) rows for the
+        in-memory search index: every live user when since is None, otherwise
+        users updated since the given time or inserted after after_id
+        """
+        columns = [User.id] + [getattr(User, column) for column in User.SEARCH_COLUMNS] + [User.deleted_at]
+        if since is None:
+            criterion = User.live()
+        else:
+            criterion = or_(User.id > after_id, User.updated_at >= since)
+        statement = select(columns).where(criterion).order_by(User.id).execution_options(stream_results=True)
+        result = db.session.execute(statement)
+        while True:
+            chunk = result.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def _ranked_matches(query, pattern, matches, limit, fields, max_candidates):
+        """
+        Scores at most max_candidates live users matching any of matches,
+        returns the best limit of them as row tuples (id plus the given
+        fields, then the score)
+        """
+        columns = [getattr(User, column) for column in User.SEARCH_COLUMNS]
+        candidates = (
+            select(User._columns(fields) + [column for column in columns if column.key not in fields])
+            .where(and_(User.live(), or_(*matches)))
+            .limit(max_candidates)
+            .alias("candidates")
+        )
+        # same score as utils.search.score: similarity, +1 for a substring, +0.5 more for a prefix
+        rank = func.greatest(*[
+            func.coalesce(func.similarity(text, query), 0.0) + case(
+                [
+                    (text.ilike(pattern + "%", escape="\\"), 1.5),
+                    (text.ilike("%" + pattern + "%", escape="\\"), 1.0),
+                ],
+                else_=0.0,
+            )
+            for text in [candidates.c[column.key] for column in columns]
+        ]).label("score")
+        statement = (
+            select([candidates.c[column] for column in User.row_columns(fields)] + [rank])
+            .order_by(rank.desc(), candidates.c.id)
+            .limit(limit)
+        )
+        return db.session.execute(statement).fetchall()
+
+    @staticmethod
+    def search(query, limit, offset=0, fields=RESPONSE_FIELDS, threshold=0.3, max_candidates=1000, fuzzy_timeout=200):
+        """
+        Ranked fuzzy search of live users over the search columns with
+        pg_trgm, returns row tuples (id plus the given fields, then the score).
+        Substring matches (prefixes for queries shorter than 3 characters) are
+        looked up first. Trigram matches of at least threshold similarity are
+        only looked up when those do not fill the page, within fuzzy_timeout
+        milliseconds. Each lookup scores at most max_candidates users, so very
+        common queries rank an arbitrary subset of their matches.
+        """
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        columns = [getattr(User, column) for column in User.SEARCH_COLUMNS]
+        if len(query) < 3:
+            matches = [column.ilike(pattern + "%", escape="\\") for column in columns]
+        else:
+            matches = [column.ilike("%" + pattern + "%", escape="\\") for column in columns]
+        wanted = offset + limit
+        rows = User._ranked_matches(query, pattern, matches, wanted, fields, max_candidates)
+        if len(query) >= 3 and len(rows) < wanted:
+            # SET LOCAL settings end with the savepoint. The planner assumes
+            # 5% of the rows pass "%" and would rather scan the whole table.
+            savepoint = db.session.begin_nested()
+            try:
+                db.session.execute(select([
+                    func.set_config("pg_trgm.similarity_threshold", str(threshold), True),
+                    func.set_config("enable_seqscan", "off", True),
+                    func.set_config("statement_timeout", str(int(fuzzy_timeout)), True),
+                ]))
+                # "%" is the pg_trgm similarity operator, doubled for the pyformat paramstyle
+                fuzzy = [column.op("%%")(query) for column in columns]
+                found = {row.id for row in rows}
+                rows += [
+                    row for row in User._ranked_matches(query, pattern, fuzzy, wanted, fields, max_candidates)
+                    if row.id not in found
+                ]
+            except OperationalError as e:
+                # query_canceled, the page keeps the substring matches only
+                if getattr(e.orig, "pgcode", None) != "57014":
+                    raise
+                log.info("Fuzzy search of {!r} hit the {} ms timeout".format(query, fuzzy_timeout))
+            finally:
+                savepoint.rollback()
+            rows.sort(key=lambda row: (-row[-1], row.id))
+        return rows[offset:wanted]
+
+    @staticmethod
+    def load_token_epochs(since=None):
+        """
+        Returns (id, token_epoch) of users with a non zero epoch changed since the given time
+        """
+        query = db.session.query(User.id, User.token_epoch).filter(User.token_epoch > 0)
+        if since is not None:
+            query = query.filter(User.updated_at >= since)
+        return query.all()
 
     @staticmethod
-    def generate_auth_token(email_id):
+    def generate_auth_token(email_id, user_id=None, account_type=None, token_epoch=0):
         """
-        Generates the Auth Token
+        Generates the Auth Token. With user_id the token is self-contained: it
+        carries the id, account type and token epoch, so authenticated requests
+        need no user lookup.
         """
         try:
             payload = {
@@ -115,6 +671,8 @@ class User(db.Model):
                 "iat": datetime.datetime.utcnow(),
                 "sub": email_id,
             }
+            if user_id is not None:
+                payload.update({"id": user_id, "account_type": account_type, "tev": token_epoch or 0})
             return jwt.encode(payload, os.getenv("SECRET_KEY"), algorithm="HS256")
         except Exception as e:
             log.info(e)
@@ -125,32 +683,122 @@ class User(db.Model):
         """
         db.session.add(self)
         db.session.flush()
+        VaccinationSummary.apply_deltas(VaccinationSummary.deltas([], [self.summary_values()]))
+        User.sync_doses([self.id])
         db.session.commit()
+        if User.cache is not None:
+            User.cache.delete("email:{}".format(self.email))
+        User.search_index.mark_stale()
 
     def update(self, filter_param, update_params):
         """
         Updates the object data to DB.
         """
-        db.session.query(self.__class__).filter_by(**filter_param).update(update_params)
+        query = db.session.query(self.__class__).filter_by(**filter_param).filter(User.live())
+        if VaccinationSummary.enabled and set(SOURCE_COLUMNS) & set(update_params):
+            columns = [getattr(User, column) for column in SOURCE_COLUMNS]
+            old_rows = [row._asdict() for row in query.with_entities(*columns).with_for_update()]
+            changes = {k: v for k, v in update_params.items() if k in SOURCE_COLUMNS}
+            new_rows = [dict(row, **changes) for row in old_rows]
+            VaccinationSummary.apply_deltas(VaccinationSummary.deltas(old_rows, new_rows))
+        dose_ids = None
+        if set(User.DOSE_COLUMNS) & set(update_params):
+            if set(filter_param) == {"id"}:
+                dose_ids = [filter_param["id"]]
+            else:
+                dose_ids = [user_id for (user_id,) in query.with_entities(User.id)]
+        revokes_tokens = bool(set(User.TOKEN_REVOKING_COLUMNS) & set(update_params))
+        if revokes_tokens:
+            update_params = dict(update_params, token_epoch=User.token_epoch + 1)
+        query.update(update_params, synchronize_session=False)
+        User.sync_doses(dose_ids)
         db.session.commit()
+        User.invalidate_cache(filter_param)
+        if set(User.SEARCH_COLUMNS) & set(update_params):
+            User.search_index.mark_stale()
+        if revokes_tokens:
+            User.token_epochs.mark_stale()
 
     def delete(self, filter_param):
         """
-        Sets status of object as False in DB
+        Soft deletes the matching live users and revokes their tokens, returns
+        how many were deleted. Rows stay as tombstones until purge_deleted.
         """
-        db.session.query(self.__class__).filter_by(**filter_param).update({"deleted_at": self.deleted_at})
+        query = db.session.query(self.__class__).filter_by(**filter_param).filter(User.live())
+        if VaccinationSummary.enabled:
+            columns = [getattr(User, column) for column in SOURCE_COLUMNS]
+            old_rows = [row._asdict() for row in query.with_entities(*columns).with_for_update()]
+            VaccinationSummary.apply_deltas(VaccinationSummary.deltas(old_rows, []))
+        deleted = query.update(
+            {"deleted_at": datetime.datetime.utcnow(), "token_epoch": User.token_epoch + 1},
+            synchronize_session=False,
+        )
         db.session.commit()
+        User.invalidate_cache(filter_param)
+        User.token_epochs.mark_stale()
+        User.search_index.mark_stale()
+        return deleted
 
     @staticmethod
-    def find_by_email(email):
+    def purge_deleted(retention, batch_size=PURGE_BATCH_SIZE, pause=0):
         """
-        Returns user object from DB using email
+        Hard deletes tombstones older than retention (a timedelta) with their
+        doses, one short transaction per batch so the User table is never
+        locked for long. Concurrent purges skip each other's locked rows.
+        """
+        cutoff = datetime.datetime.utcnow() - retention
+        purged = 0
+        while True:
+            ids = [
+                user_id for (user_id,) in db.session.query(User.id)
+                .filter(User.deleted_at < cutoff)
+                .order_by(User.deleted_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ]
+            if not ids:
+                db.session.commit()
+                break
+            db.session.query(Dose).filter(Dose.user_id.in_(ids)).delete(synchronize_session=False)
+            db.session.query(User).filter(User.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            purged += len(ids)
+            log.info("Purged {} deleted users".format(purged))
+            if pause:
+                time.sleep(pause)
+        return purged
+
+    @staticmethod
+    def find_by_email(email, use_cache=True):
+        """
+        Returns user object from DB using email. Authentication passes
+        use_cache=False so a changed password or role is always read from the DB.
         """
         try:
-            user_obj = User.query.filter_by(email=email).first()
+            user_obj = User._cached("email:{}".format(email)) if use_cache else None
+            if user_obj:
+                return user_obj
+            query = User.query.filter_by(email=email).filter(User.live())
+            if not use_cache:
+                # an instance merged from the cache earlier in the session must not win
+                query = query.populate_existing()
+            with replicas.on_primary(User.cache is not None):
+                user_obj = query.first()
             if user_obj:
+                user_obj._store_in_cache()
                 return user_obj
             return False
         except Exception as e:
             log.info(e, exc_info=True)
             return False
+
+
+User.token_epochs = EpochTable(User.load_token_epochs)
+User.search_index = SearchIndex(User.load_search_rows)
+
+# The trigram indexes need the pg_trgm extension
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
@@ -0,0 +1,164 @@
+from collections import Counter
+import random
+
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.dialects import postgresql
+
+import os, sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+from constants import db, AGE_BANDS
+
+# pg_advisory_xact_lock key, shared by the writers of deltas and taken alone by a rebuild
+SUMMARY_LOCK_ID = 7270302
+
+# User columns the summary groups are derived from
+SOURCE_COLUMNS = (
+    "gender",
+    "age",
+    "vaccine_name",
+    "first_doze_taken",
+    "second_doze_taken",
+    "is_fully_vaccinated",
+)
+GROUP_COLUMNS = (
+    "gender",
+    "age_band",
+    "vaccine_name",
+    "first_doze_taken",
+    "second_doze_taken",
+    "is_fully_vaccinated",
+)
+
+
+def age_band(age):
+    """
+    Returns the AGE_BANDS label of an age, "" when unknown
+    """
+    if age is None or age == "":
+        return ""
+    age = int(age)
+    for upper, label in AGE_BANDS:
+        if upper is None or age < upper:
+            return label
+
+
+def group_key(values):
+    """
+    Returns the summary group of a user given its column values
+    """
+    key = []
+    for column in GROUP_COLUMNS:
+        value = age_band(values.get("age")) if column == "age_band" else values.get(column)
+        key.append("" if value is None else str(value))
+    return tuple(key)
+
+
+class VaccinationSummary(db.Model):
+    """
+    Number of users per combination of the coverage dimensions. Kept up to date
+    incrementally by every write on User when enabled, so coverage reads cost
+    O(groups) instead of O(users). Enabling it on an existing database requires
+    a rebuild (migrate --rebuild-stats).
+    Every group is split over `shards` rows, a write adds to a random one and
+    reads sum them, so concurrent writers of a group rarely wait on one row.
+    """
+    __tablename__ = "VaccinationSummary"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    gender = db.Column(db.String(), nullable=False, default="")
+    age_band = db.Column(db.String(), nullable=False, default="")
+    vaccine_name = db.Column(db.String(), nullable=False, default="")
+    first_doze_taken = db.Column(db.String(), nullable=False, default="")
+    second_doze_taken = db.Column(db.String(), nullable=False, default="")
+    is_fully_vaccinated = db.Column(db.String(), nullable=False, default="")
+    shard = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(*GROUP_COLUMNS, "shard", name="uq_vaccination_summary_group"),
+    )
+
+    enabled = False
+    shards = 1
+
+    @staticmethod
+    def _lock(shared):
+        """
+        Takes the summary lock until the end of the transaction on PostgreSQL
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+            db.session.execute(select([lock(SUMMARY_LOCK_ID)]))
+
+    @staticmethod
+    def _insert_missing():
+        """
+        INSERT statement skipping the rows whose group and shard already exist
+        """
+        table = VaccinationSummary.__table__
+        if db.session.get_bind().dialect.name == "postgresql":
+            return postgresql.insert(table).on_conflict_do_nothing(constraint="uq_vaccination_summary_group")
+        return table.insert().prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+
+    @staticmethod
+    def apply_deltas(deltas):
+        """
+        Adds the per group deltas to one random shard in the current
+        transaction, the caller commits. Missing rows are created empty first
+        and ignored when they exist, then every row is updated, so concurrent
+        writers never race between an UPDATE and an INSERT.
+        """
+        if not VaccinationSummary.enabled:
+            return
+        VaccinationSummary._lock(shared=True)
+        shard = random.randrange(VaccinationSummary.shards)
+        # sorted, concurrent transactions lock the rows in the same order
+        rows = [
+            (dict(zip(GROUP_COLUMNS, key), shard=shard), delta) for key, delta in sorted(deltas.items()) if delta
+        ]
+        if not rows:
+            return
+        table = VaccinationSummary.__table__
+        db.session.execute(VaccinationSummary._insert_missing(), [dict(group, count=0) for group, _ in rows])
+        match = and_(*[table.c[c] == bindparam("group_" + c) for c in GROUP_COLUMNS + ("shard",)])
+        db.session.execute(
+            table.update().where(match).values(count=table.c.count + bindparam("delta")),
+            [dict({"group_" + c: v for c, v in group.items()}, delta=delta) for group, delta in rows],
+        )
+
+    @staticmethod
+    def deltas(old_rows, new_rows):
+        """
+        Returns the group deltas of replacing old_rows by new_rows (dicts of column values)
+        """
+        deltas = Counter(group_key(row) for row in new_rows)
+        deltas.subtract(Counter(group_key(row) for row in old_rows))
+        return deltas
+
+    @staticmethod
+    def rebuild(load_counts):
+        """
+        Replaces the whole summary with load_counts(), a {group key: count}
+        mapping. Writers of deltas wait until it commits, so none is applied
+        between the snapshot and the new rows.
+        """
+        VaccinationSummary._lock(shared=False)
+        grouped_counts = load_counts()
+        db.session.query(VaccinationSummary).delete()
+        if grouped_counts:
+            db.session.execute(
+                VaccinationSummary.__table__.insert(),
+                [dict(zip(GROUP_COLUMNS, key), count=count) for key, count in grouped_counts.items()],
+            )
+        db.session.commit()
+
+    @staticmethod
+    def grouped_counts():
+        """
+        Returns {group key: count} of all non empty groups
+        """
+        columns = [VaccinationSummary.__table__.c[c] for c in GROUP_COLUMNS]
+        total = func.sum(VaccinationSummary.count)
+        rows = db.session.query(*columns, total).group_by(*columns).having(total > 0)
+        return {tuple(row[:-1]): int(row[-1]) for row in rows}
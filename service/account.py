@@ -1,13 +1,17 @@
 # Standard imports
-from flask import Response
+from flask import Response, stream_with_context
 import logging as log
 import json
 from datetime import datetime, timedelta
-from constants import BASE_HEADERS, bcrypt
+from itertools import chain
+from constants import BASE_HEADERS, MAX_PAGE_LIMIT
 
 # Custom imports
 from models.user import User
-from constants import EMAIL_REGEX, bcrypt
+from constants import EMAIL_REGEX
+from utils import http_cache, replicas, search
+from utils.filters import compile_filters, compile_sort
+from utils.hashing import check_password, hash_password
 from utils.exceptions import (
     InvalidEmailError,
     UserAlreadyExistsError,
@@ -21,7 +25,7 @@ def _valid_password(user_object, provided_password):
     """
     Checks user creds and tells if user can login or not
     """
-    return bool(bcrypt.check_password_hash(user_object.password, provided_password))
+    return check_password(user_object.password, provided_password)
 
 def register(details):
     """
@@ -53,7 +57,7 @@ def authenticate(details):
     if not EMAIL_REGEX.fullmatch(post_data.get("email")):
         log.warning("The entered email is invalid {}".format(post_data.get("email")))
         raise InvalidEmailError
-    user_obj = User.find_by_email(email=post_data.get("email", ""))
+    user_obj = User.find_by_email(email=post_data.get("email", ""), use_cache=False)
     if not user_obj:
         log.warning("User not found - {}".format(post_data.get("email")))
         raise AuthError()
@@ -62,7 +66,9 @@ def authenticate(details):
     ):
         log.warning("Auth Failed, Valid username/password required - {}".format(post_data.get("password")))
         raise AuthError()
-    auth_token = user_obj.generate_auth_token(user_obj.email)
+    auth_token = user_obj.generate_auth_token(
+        user_obj.email, user_obj.id, user_obj.account_type, user_obj.token_epoch
+    )
     if not auth_token:
         log.warning("Cannot generate Auth Token")
         raise AuthTokenGenError()
@@ -97,10 +103,19 @@ def modify(account_id, details):
             raise InvalidEmailError
         post_data["email"] = post_data.get("updated_email")
 
+    if post_data.get("age") is not None:
+        try:
+            # int() would take true and truncate 30.5
+            if isinstance(post_data["age"], (bool, float)):
+                raise ValueError(post_data["age"])
+            post_data["age"] = int(post_data["age"])
+        except (TypeError, ValueError):
+            raise ParameterError(message="age must be an integer")
+
+    # only bumped by the model, a client cannot un-revoke its tokens
+    post_data.pop("token_epoch", None)
     if "password" in post_data:
-        post_data["password"] = bcrypt.generate_password_hash(
-                post_data.get("password")
-            ).decode()
+        post_data["password"] = hash_password(post_data.get("password"))
     # will restrict user but not admin
     if details.get("account_type") != "admin":
         account_id = details.get("id")
@@ -113,40 +128,189 @@ def modify(account_id, details):
     return response
 
 
+def _page_args(limit, after, offset=None):
+    """
+    Parses and bounds the pagination params
+    """
+    try:
+        limit = int(limit)
+        after = int(after) if after not in (None, "") else None
+        offset = int(offset) if offset not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ParameterError(message="limit, after and offset must be integers")
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        raise ParameterError(message="limit must be between 1 and {}".format(MAX_PAGE_LIMIT))
+    if offset is not None and offset < 0:
+        raise ParameterError(message="offset must not be negative")
+    return limit, after, offset
+
+
+def _is_true(value):
+    return value in (True, "True", "true")
+
+
+def _list_filters(request_details):
+    """
+    Pops the filter params off the request and compiles them into
+    (criteria, order). Supports the legacy filter=<column>&value=<v> pair,
+    filter=all, field[__op]=value params and a JSON where tree.
+    """
+    params = request_details.get("params") or {}
+    legacy_filter = params.pop("filter", None)
+    legacy_value = params.pop("value", None)
+    auth = _is_true(params.pop("auth", False))
+    where = params.pop("where", None)
+    order = compile_sort(User, User.FILTER_FIELDS, params.pop("sort", None))
+    criteria = compile_filters(User, User.FILTER_FIELDS, params, where)
+    if legacy_filter and legacy_filter != "all":
+        criteria += compile_filters(User, User.FILTER_FIELDS, {legacy_filter: legacy_value})
+    if auth:
+        criteria.append(User.email == request_details.get("email"))
+    if not criteria and legacy_filter != "all":
+        raise ParameterError(message="filter or auth param required")
+    return criteria, order
+
+
+def _projection(fields, allowed):
+    """
+    Parses the comma separated fields param, defaults to all allowed fields
+    """
+    if not fields:
+        return allowed
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ParameterError(message="unknown fields: {}".format(",".join(sorted(unknown))))
+    return tuple(f for f in allowed if f in requested)
+
+
+def _stream_json_array(chunks, fields):
+    """
+    Writes the rows of every chunk as one JSON array, a chunk at a time
+    """
+    serialize = User.row_serializer(fields)
+    yield "["
+    separator = ""
+    for chunk in chunks:
+        yield separator + ",".join([serialize(row) for row in chunk])
+        separator = ","
+    yield "]"
+
+
 def fetch_accounts(request_details):
     """
-    Fetches user accounts based on multiple filter or filters
+    Fetches user accounts matching the filters (see utils.filters).
+    Passing limit returns a single page: keyset based in the default id order
+    (after = next_cursor of the previous page), offset based for custom sorts.
+    count_only returns the number of matches, otherwise all matching accounts
+    are streamed.
     """
     if request_details.get("account_type") != "admin":
         return UserUnauthorizedError()
-    _filter = {}
-    fetch_all = False
-    if request_details.get("params").get("filter") == "all":
-        fetch_all = True
-        details = {}
-    else:
-        details = {request_details.get("params").get("filter"): request_details.get("params").get("value")}
-    if request_details.get("params", {}).pop("auth", False) in ("True", "true"):
-        _filter["email"] = request_details.get("email")
-    elif request_details.get("account_type") != "admin" and request_details.get("params"):
-        _filter["email"] = request_details.get("email")
-        _filter.update(details)
-    elif request_details.get("account_type") == "admin" and request_details.get("params"):
-        _filter.update(details)
-    else:
-        raise ParameterError(message="filter or auth param required")
-    if fetch_all:
-        data = User().fetch_all({"filter": "all"})
-    else:
-        data = User().fetch_all(params=_filter)
-    if not data:
-        log.warning("User not found".format(_filter))
+    params = request_details.get("params") or {}
+    limit = params.pop("limit", None)
+    after = params.pop("after", None)
+    offset = params.pop("offset", None)
+    count_only = _is_true(params.pop("count_only", False))
+    fields = _projection(params.pop("fields", None), User.RESPONSE_FIELDS)
+    criteria, order = _list_filters(request_details)
+
+    if count_only:
+        response = Response(
+                response=json.dumps(obj={"count": User.count(criteria)}),
+                status=200,
+                mimetype="application/json"
+            )
+        return response
+
+    if limit is not None:
+        limit, after, offset = _page_args(limit, after, offset)
+        if order is not None and after is not None:
+            raise ParameterError(message="after can only be used with the default id order, use offset")
+        if order is None and offset is not None:
+            raise ParameterError(message="offset can only be used with sort, use after")
+        data = User.fetch_page(criteria, limit, after=after, order=order, offset=offset, fields=fields)
+        if not data and after is None and not offset:
+            log.warning("User not found")
+            return NotFoundError()
+        serialize = User.row_serializer(fields)
+        next_cursor = data[-1].id if order is None and len(data) == limit else None
+        resp_data = '{{"data":[{}],"next_cursor":{}}}'.format(
+            ",".join([serialize(row) for row in data]), json.dumps(obj=next_cursor)
+        )
+        response = Response(
+                response=resp_data,
+                status=200,
+                mimetype="application/json"
+            )
+        return response
+
+    chunks = User.iter_chunks(criteria, order=order, fields=fields)
+    first_chunk = next(chunks, None)
+    if not first_chunk:
+        log.warning("User not found")
         return NotFoundError()
-    resp_data = []
-    for d in data:
-        resp_data.append(d.to_response_dict())
     response = Response(
-            response=json.dumps(obj=resp_data),
+            response=stream_with_context(_stream_json_array(chain([first_chunk], chunks), fields)),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def _search_page(query, limit, offset, fields):
+    """
+    One page of (row, score) best first, from pg_trgm on PostgreSQL and from
+    the in-memory index otherwise
+    """
+    if search.backend == "postgres":
+        rows = User.search(
+            query, limit, offset=offset, fields=fields,
+            threshold=search.settings["SIMILARITY_THRESHOLD"],
+            max_candidates=search.settings["MAX_CANDIDATES"],
+            fuzzy_timeout=search.settings["FUZZY_TIMEOUT_MS"],
+        )
+        return [(row[:-1], round(row[-1], 4)) for row in rows]
+    ranked = User.search_index.search(query)[offset:offset + limit]
+    if not ranked:
+        return []
+    rows = {row.id: row for row in User.fetch_page([User.id.in_([doc_id for doc_id, _ in ranked])], limit, fields=fields)}
+    # users deleted since the last catch up are missing from rows
+    return [(rows[doc_id], round(value, 4)) for doc_id, value in ranked if doc_id in rows]
+
+
+def search_accounts(request_details):
+    """
+    Ranked fuzzy search of user accounts by name, email or phone number.
+    Exact substring and prefix matches rank first, then typo tolerant
+    trigram matches. Pages are offset based (offset = next_offset).
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    params = request_details.get("params") or {}
+    query = (params.get("q") or "").strip()
+    if len(query) < search.settings["MIN_QUERY_LENGTH"]:
+        raise ParameterError(
+            message="q must be at least {} characters".format(search.settings["MIN_QUERY_LENGTH"])
+        )
+    limit, _, offset = _page_args(params.get("limit") or 20, None, params.get("offset"))
+    offset = offset or 0
+    # at most MAX_CANDIDATES matches are ranked
+    if offset + limit > search.settings["MAX_CANDIDATES"]:
+        raise ParameterError(
+            message="offset + limit must not exceed {}".format(search.settings["MAX_CANDIDATES"])
+        )
+    fields = _projection(params.get("fields"), User.RESPONSE_FIELDS)
+    page = _search_page(query, limit, offset, fields)
+    serialize = User.row_serializer(fields)
+    more = len(page) == limit and offset + 2 * limit <= search.settings["MAX_CANDIDATES"]
+    next_offset = offset + limit if more else None
+    resp_data = '{{"data":[{}],"next_offset":{}}}'.format(
+        ",".join(['{{"score":{},{}'.format(json.dumps(obj=value), serialize(row)[1:]) for row, value in page]),
+        json.dumps(obj=next_offset),
+    )
+    response = Response(
+            response=resp_data,
             status=200,
             mimetype="application/json"
         )
@@ -155,19 +319,38 @@ def fetch_accounts(request_details):
 
 def fetch_object(kwargs):
     """
-    returns object of queried param
+    returns object of queried param, restricted to the requested fields.
+    Responses carry a strong ETag derived from the row version and are served
+    from the response cache when possible; a matching If-None-Match gets a 304.
     """
     params = {"id":kwargs.get("id")}
-    data = User().fetch_user(params).to_response_dict()
     vaccine_data = kwargs.get("vaccine_data", False)
-    if not vaccine_data:
-        data.pop("vaccine_name")
-        data.pop("first_doze_taken")
-        data.pop("first_doze_date")
-        data.pop("second_doze_taken")
-        data.pop("second_doze_date")
-        data.pop("is_fully_vaccinated")
-    return data
+    allowed = User.RESPONSE_FIELDS if vaccine_data else User.ACCOUNT_FIELDS
+    fields = _projection(kwargs.get("fields"), allowed)
+    variant = "{}:{}".format("vaccines" if vaccine_data else "account", ",".join(fields))
+    cached = http_cache.get(params["id"], variant)
+    if cached:
+        etag, body = cached
+    else:
+        # the response is cached for every reader, it must not come from a lagging replica
+        with replicas.on_primary(http_cache.response_cache is not None):
+            data = User.fetch_fields(params, fields + ("updated_at",))
+        if data is None:
+            log.warning("User not found {}".format(params))
+            return NotFoundError()
+        etag = http_cache.make_etag(params["id"], data.pop("updated_at"), variant)
+        body = json.dumps(obj=data)
+        http_cache.store(params["id"], variant, etag, body)
+    headers = {"ETag": '"{}"'.format(etag), "Cache-Control": "private, no-cache"}
+    if http_cache.is_not_modified(etag):
+        return Response(status=304, headers=headers)
+    response = Response(
+            response=body,
+            status=200,
+            headers=headers,
+            mimetype="application/json"
+        )
+    return response
 
 
 def delete(account_id, details):
@@ -177,13 +360,12 @@ def delete(account_id, details):
     if details.get("account_type") != "admin":
         account_id = details.get("id")
 
-    user_arr = User().fetch_by_id(params={"id": account_id})
-    if not user_arr:
+    user_obj = User.fetch_user(params={"id": account_id})
+    if not user_obj:
         log.warning("user does not exist")
         return NotFoundError()
 
-    user_obj = User.find_by_email(user_arr[0].get("email"))
-    user_obj.delete()
+    user_obj.delete(filter_param={"id": user_obj.id})
     response = Response(
                 response=json.dumps(obj={"message":"User Deleted successfully"}),
                 status=200,
@@ -0,0 +1,381 @@
+# Standard imports
+from flask import Response
+import logging as log
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+# Custom imports
+from models.user import User
+from models.vaccination_summary import SOURCE_COLUMNS, VaccinationSummary
+from constants import BATCH_UPDATE_CHUNK_SIZE, EMAIL_REGEX, IMPORT_BATCH_SIZE, db
+from utils.hashing import hash_passwords
+from utils.exceptions import ParameterError, UserUnauthorizedError
+
+IMPORT_REQUIRED_FIELDS = ("email", "password", "name", "gender", "age", "phone_number", "account_type")
+IMPORT_OPTIONAL_FIELDS = (
+    "vaccine_name",
+    "first_doze_taken",
+    "first_doze_date",
+    "second_doze_taken",
+    "second_doze_date",
+    "is_fully_vaccinated",
+)
+IMPORT_COLUMNS = IMPORT_REQUIRED_FIELDS + IMPORT_OPTIONAL_FIELDS
+DATE_FIELDS = ("first_doze_date", "second_doze_date")
+STRING_FIELDS = tuple(f for f in IMPORT_COLUMNS if f != "age" and f not in DATE_FIELDS)
+
+
+def _import_format(filename, mimetype, requested_format):
+    """
+    Works out csv / jsonl from the format param, file name or content type
+    """
+    if requested_format:
+        fmt = requested_format.lower()
+    else:
+        name = (filename or "").lower()
+        mimetype = (mimetype or "").lower()
+        if name.endswith(".csv") or "csv" in mimetype:
+            fmt = "csv"
+        elif name.endswith((".jsonl", ".ndjson")) or "ndjson" in mimetype or "jsonl" in mimetype:
+            fmt = "jsonl"
+        else:
+            fmt = None
+    if fmt not in ("csv", "jsonl"):
+        raise ParameterError(message="format must be csv or jsonl")
+    return fmt
+
+
+class _RawReader(io.RawIOBase):
+    """
+    Raw binary stream over anything with a read(size) method. Werkzeug spools
+    uploads to a SpooledTemporaryFile, which before Python 3.11 lacks the
+    readable() TextIOWrapper requires.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _read_rows(stream, fmt):
+    """
+    Yields (row_number, row, error) for every record of the upload without
+    reading the whole file in memory
+    """
+    text = io.TextIOWrapper(io.BufferedReader(_RawReader(stream)), encoding="utf-8", newline="")
+    if fmt == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, row, None
+        return
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield row_number, None, "invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield row_number, None, "row must be a JSON object"
+            continue
+        yield row_number, row, None
+
+
+def _clean_row(row):
+    """
+    Validates one imported record, returns (values, error)
+    """
+    missing = [f for f in IMPORT_REQUIRED_FIELDS if row.get(f) in (None, "")]
+    if missing:
+        return None, "missing required params: {}".format(",".join(missing))
+    values = {f: None if row.get(f) == "" else row.get(f) for f in IMPORT_COLUMNS}
+    wrong = [f for f in STRING_FIELDS if values[f] is not None and not isinstance(values[f], str)]
+    if wrong:
+        return None, "payload type error: strings expected for {}".format(",".join(wrong))
+    if not EMAIL_REGEX.fullmatch(values["email"]):
+        return None, "The entered email is invalid"
+    try:
+        # int() would take true and truncate 30.5
+        if isinstance(values["age"], (bool, float)):
+            raise ValueError(values["age"])
+        values["age"] = int(values["age"])
+        for f in DATE_FIELDS:
+            if values[f]:
+                values[f] = date.fromisoformat(values[f])
+    except (TypeError, ValueError):
+        return None, "payload type error: age must be an integer and dates YYYY-MM-DD"
+    return values, None
+
+
+def _copy_rows(rows):
+    """
+    Loads rows with COPY on PostgreSQL, inside the session transaction.
+    COPY skips the Python side column defaults, updated_at is written here.
+    """
+    columns = IMPORT_COLUMNS + ("updated_at",)
+    updated_at = datetime.utcnow()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        values = dict(row, updated_at=updated_at)
+        writer.writerow([
+            values[c].isoformat() if isinstance(values[c], date) else values[c]
+            for c in columns
+        ])
+    buffer.seek(0)
+    statement = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        User.__tablename__, ", ".join(columns)
+    )
+    dbapi = db.session.get_bind().dialect.dbapi
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except dbapi.IntegrityError as e:
+        # raw DBAPI errors are not wrapped by SQLAlchemy
+        raise IntegrityError(statement, None, e)
+    finally:
+        cursor.close()
+
+
+def _insert_rows(rows):
+    if db.session.get_bind().dialect.name == "postgresql":
+        _copy_rows(rows)
+    else:
+        db.session.execute(User.__table__.insert(), rows)
+
+
+def _insert_batch(batch, errors, before_commit=None):
+    """
+    Inserts a validated batch, falling back to row by row inserts when a
+    concurrent writer makes the batch statement fail, so only the bad rows
+    are rejected. before_commit(last row, rows inserted) runs inside every
+    transaction right before it commits. Returns the number of inserted rows.
+    """
+    emails = [values["email"] for _, values in batch]
+    existing = {
+        email for (email,) in db.session.query(User.email).filter(User.email.in_(emails), User.live())
+    }
+    fresh = []
+    for row_number, values in batch:
+        if values["email"] in existing:
+            errors.append({"row": row_number, "email": values["email"], "error": "User already exists"})
+        else:
+            fresh.append((row_number, values))
+    if not fresh:
+        return 0
+
+    hashes = hash_passwords([values["password"] for _, values in fresh])
+    rows = []
+    for (_, values), password_hash in zip(fresh, hashes):
+        values["password"] = password_hash
+        rows.append(values)
+    try:
+        _insert_rows(rows)
+        VaccinationSummary.apply_deltas(VaccinationSummary.deltas([], rows))
+        User.sync_doses([
+            user_id for (user_id,) in
+            db.session.query(User.id).filter(User.email.in_([row["email"] for row in rows]), User.live())
+        ])
+        if before_commit is not None:
+            before_commit(batch[-1][0], len(rows))
+        db.session.commit()
+        inserted = rows
+    except IntegrityError:
+        db.session.rollback()
+        inserted = []
+        for row_number, values in fresh:
+            try:
+                result = db.session.execute(User.__table__.insert(), [values])
+                VaccinationSummary.apply_deltas(VaccinationSummary.deltas([], [values]))
+                User.sync_doses(result.inserted_primary_key)
+                if before_commit is not None:
+                    before_commit(row_number, len(inserted) + 1)
+                db.session.commit()
+                inserted.append(values)
+            except IntegrityError:
+                db.session.rollback()
+                errors.append({"row": row_number, "email": values["email"], "error": "User already exists"})
+    if User.cache is not None:
+        User.cache.delete(*["email:{}".format(values["email"]) for values in inserted])
+    return len(inserted)
+
+
+def import_accounts(stream, fmt, on_batch=None, resume=None, before_commit=None):
+    """
+    Registers every account of a CSV / JSONL stream in batches, returns the
+    summary of inserted and rejected rows. on_batch(rows read so far) is
+    called after every committed batch.
+    before_commit(state) is called inside every insert transaction with the
+    state to carry on from once it committed, passing that state as resume
+    skips the rows it covers instead of inserting them again.
+    """
+    resume = resume or {}
+    inserted, errors, batch, batch_emails = resume.get("inserted", 0), list(resume.get("errors", [])), [], set()
+
+    def checkpoint(row_number, batch_inserted):
+        before_commit({
+            "rows": row_number,
+            "inserted": inserted + batch_inserted,
+            "errors": [e for e in errors if e["row"] <= row_number],
+        })
+
+    hook = checkpoint if before_commit is not None else None
+    for row_number, row, error in _read_rows(stream, fmt):
+        if row_number <= resume.get("rows", 0):
+            continue
+        if not error:
+            values, error = _clean_row(row)
+        if not error and values["email"] in batch_emails:
+            error = "duplicate email in upload"
+        if error:
+            errors.append({"row": row_number, "email": (row or {}).get("email"), "error": error})
+            continue
+        batch.append((row_number, values))
+        batch_emails.add(values["email"])
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            inserted += _insert_batch(batch, errors, hook)
+            batch, batch_emails = [], set()
+            if on_batch is not None:
+                on_batch(row_number)
+    if batch:
+        inserted += _insert_batch(batch, errors, hook)
+
+    log.info("Bulk import finished, {} inserted, {} rejected".format(inserted, len(errors)))
+    return {
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda e: e["row"]),
+    }
+
+
+def bulk_import(details, stream, filename=None, mimetype=None, requested_format=None):
+    """
+    Registers every account of an uploaded CSV / JSONL file in batches and
+    reports the rows that were rejected
+    """
+    if details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    fmt = _import_format(filename, mimetype, requested_format)
+    data = import_accounts(stream, fmt)
+    response = Response(
+            response=json.dumps(obj=data),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def _describe(error):
+    """
+    One line description of a validator error response
+    """
+    detail = error.get("missing") or error.get("unknown")
+    return "{}: {}".format(error["message"], detail) if detail else error["message"]
+
+
+def _apply_vaccination_chunk(chunk, results):
+    """
+    Applies one chunk of updates in a single transaction with one executemany
+    per distinct set of updated columns
+    """
+    ids = {ac_id for _, ac_id, _ in chunk}
+    track_summary = VaccinationSummary.enabled
+    columns = [User.id] + ([getattr(User, c) for c in SOURCE_COLUMNS] if track_summary else [])
+    table = User.__table__
+    found = set()
+    try:
+        query = db.session.query(*columns).filter(User.id.in_(ids), User.live())
+        if track_summary:
+            query = query.with_for_update()
+        current = {row.id: row._asdict() for row in query}
+        found = set(current)
+        old_rows = list(current.values())
+        groups = {}
+        for index, ac_id, values in chunk:
+            if ac_id not in found:
+                results[index].update(status="error", error="User not found")
+                continue
+            current[ac_id] = dict(current[ac_id], **values)
+            row = {"b_{}".format(k): v for k, v in values.items()}
+            row["b_id"] = ac_id
+            groups.setdefault(tuple(sorted(values)), []).append(row)
+        for columns, rows in groups.items():
+            statement = (
+                table.update()
+                .where(table.c.id == bindparam("b_id"))
+                .values({c: bindparam("b_{}".format(c)) for c in columns})
+            )
+            db.session.execute(statement, rows)
+        if track_summary:
+            new_rows = list(current.values())
+            VaccinationSummary.apply_deltas(VaccinationSummary.deltas(old_rows, new_rows))
+        User.sync_doses([
+            ac_id for index, ac_id, values in chunk
+            if ac_id in found and set(User.DOSE_COLUMNS) & set(values)
+        ])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        log.warning("Batch vaccination update failed - {}".format(e))
+        for index, ac_id, _ in chunk:
+            if "status" not in results[index]:
+                results[index].update(status="error", error="update failed")
+        return
+    for index, ac_id, _ in chunk:
+        if ac_id in found:
+            results[index]["status"] = "updated"
+            User.invalidate_cache({"id": ac_id})
+
+
+def batch_update_vaccinations(details, items, validator):
+    """
+    Updates vaccination details of many users, committing every
+    BATCH_UPDATE_CHUNK_SIZE items and reporting the outcome per item.
+    Items are checked with the compiled batch item validator in one pass.
+    """
+    if details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    if isinstance(items, dict):
+        items = items.get("items")
+    if not isinstance(items, list) or not items:
+        raise ParameterError(message="a non empty list of items is required")
+
+    results, chunk = [], []
+    for index, (item, error) in enumerate(zip(items, validator.validate_many(items))):
+        ac_id = item.pop("ac_id", None) if isinstance(item, dict) else None
+        results.append({"ac_id": ac_id})
+        if error:
+            results[index].update(status="error", error=_describe(error))
+            continue
+        if not item:
+            results[index].update(status="error", error="No data to update")
+            continue
+        chunk.append((index, ac_id, item))
+        if len(chunk) >= BATCH_UPDATE_CHUNK_SIZE:
+            _apply_vaccination_chunk(chunk, results)
+            chunk = []
+    if chunk:
+        _apply_vaccination_chunk(chunk, results)
+
+    updated = sum(1 for r in results if r.get("status") == "updated")
+    data = {"updated": updated, "failed": len(results) - updated, "results": results}
+    response = Response(
+            response=json.dumps(obj=data),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
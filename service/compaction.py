@@ -0,0 +1,75 @@
+# Standard imports
+import datetime
+import logging
+import threading
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Custom imports
+from constants import PURGE_BATCH_SIZE, db
+from models.user import User
+
+LOG = logging.getLogger("root")
+
+COMPACTOR_DEFAULTS = {
+    "ENABLED": True,
+    "INTERVAL_SECONDS": 3600,
+    "RETENTION_DAYS": 30,
+    "BATCH_SIZE": PURGE_BATCH_SIZE,
+    "PAUSE_SECONDS": 0.1,
+}
+
+
+def compactor_config(config):
+    settings = dict(COMPACTOR_DEFAULTS)
+    settings.update(config or {})
+    return settings
+
+
+def purge(config):
+    """
+    Hard deletes the tombstones older than the retention period, in batches
+    """
+    settings = compactor_config(config)
+    return User.purge_deleted(
+        datetime.timedelta(days=settings["RETENTION_DAYS"]),
+        batch_size=settings["BATCH_SIZE"],
+        pause=settings["PAUSE_SECONDS"],
+    )
+
+
+class Compactor(threading.Thread):
+    """Background thread purging expired tombstones every INTERVAL_SECONDS"""
+
+    def __init__(self, app, config):
+        super().__init__(name="tombstone-compactor", daemon=True)
+        self.app = app
+        self.config = compactor_config(config)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.config["INTERVAL_SECONDS"]):
+            with self.app.app_context():
+                try:
+                    purged = purge(self.config)
+                    if purged:
+                        LOG.info("Compactor purged {} deleted users".format(purged))
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    LOG.warning("Compactor run failed - {}".format(e))
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start(app, config):
+    """
+    Starts the compactor of this process, returns None when disabled
+    """
+    if not compactor_config(config)["ENABLED"]:
+        return None
+    compactor = Compactor(app, config)
+    compactor.start()
+    return compactor
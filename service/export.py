@@ -0,0 +1,132 @@
+"""
+Streaming exports of the vaccination data.
+Rows are read through a server side cursor and written chunk by chunk, so
+memory stays constant whatever the size of the extract. Formats:
+    1. csv      -> header line then one line per user
+    2. jsonl    -> one JSON object per line
+    3. columnar -> a header line {"format", "fields", "types"} followed by one
+                   row group per line {"rows": n, "columns": {field: [values]}}
+gzip=true compresses the stream on the fly into a .gz download.
+"""
+# Standard imports
+from flask import Response, stream_with_context
+import csv
+import io
+import json
+import zlib
+
+# Custom imports
+from models.user import User
+from constants import EXPORT_CHUNK_SIZE, EXPORT_GZIP_LEVEL
+from service.account import _is_true, _list_filters, _projection
+from utils.exceptions import ParameterError, UserUnauthorizedError
+from utils.serializers import column_serializer
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "columnar": ("application/x-ndjson", "columnar.jsonl"),
+}
+
+
+def _csv_chunks(chunks, fields):
+    positions = [User.row_columns(fields).index(field) for field in fields]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(fields)
+    for chunk in chunks:
+        writer.writerows([[row[position] for position in positions] for row in chunk])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_chunks(chunks, fields):
+    serialize = User.row_serializer(fields)
+    for chunk in chunks:
+        yield "\n".join([serialize(row) for row in chunk]) + "\n"
+
+
+def _columnar_chunks(chunks, fields):
+    columns = User.row_columns(fields)
+    plan = [
+        (columns.index(field), '"{}":'.format(field), column_serializer(User.__table__, field))
+        for field in fields
+    ]
+    types = {field: str(User.__table__.c[field].type) for field in fields}
+    yield json.dumps(obj={"format": "columnar", "fields": list(fields), "types": types}) + "\n"
+    for chunk in chunks:
+        encoded = ",".join(
+            [prefix + serialize([row[position] for row in chunk]) for position, prefix, serialize in plan]
+        )
+        yield '{{"rows":{},"columns":{{{}}}}}\n'.format(len(chunk), encoded)
+
+
+WRITERS = {"csv": _csv_chunks, "jsonl": _jsonl_chunks, "columnar": _columnar_chunks}
+
+
+def _encode(parts):
+    for part in parts:
+        if part:
+            yield part.encode()
+
+
+def _gzip(parts):
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _counted(chunks, on_chunk):
+    for chunk in chunks:
+        yield chunk
+        on_chunk(len(chunk))
+
+
+def prepare_export(request_details, on_chunk=None):
+    """
+    Compiles the export params, returns (body, mimetype, extension) where
+    body lazily yields the encoded file. on_chunk(rows) is called after
+    every chunk of rows is written.
+    """
+    params = request_details.get("params") or {}
+    export_format = (params.pop("format", None) or "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ParameterError(message="format must be one of {}".format(", ".join(EXPORT_FORMATS)))
+    compress = _is_true(params.pop("gzip", False))
+    fields = _projection(params.pop("fields", None), User.RESPONSE_FIELDS)
+    criteria, order = _list_filters(request_details)
+
+    # an explicit order always streams a single server side cursor
+    chunks = User.iter_chunks(
+        criteria, order=order or [User.id], chunk_size=EXPORT_CHUNK_SIZE, fields=fields
+    )
+    if on_chunk is not None:
+        chunks = _counted(chunks, on_chunk)
+    body = _encode(WRITERS[export_format](chunks, fields))
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    if compress:
+        body = _gzip(body)
+        mimetype, extension = "application/gzip", extension + ".gz"
+    return body, mimetype, extension
+
+
+def export_vaccinations(request_details):
+    """
+    Streams every user matching the filters of fetch_accounts in the
+    requested format, admin only
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    body, mimetype, extension = prepare_export(request_details)
+    response = Response(
+            response=stream_with_context(body),
+            status=200,
+            mimetype=mimetype,
+            headers={"Content-Disposition": "attachment; filename=vaccinations.{}".format(extension)},
+        )
+    return response
@@ -0,0 +1,397 @@
+"""
+Background jobs for long running admin operations.
+Requests only queue a Job row and return its id, worker threads (in every
+server process and / or in dedicated `worker` processes) claim and run the
+jobs, so request latency is bounded whatever the size of the job.
+    1. recompute_stats -> rebuilds the coverage summary, returns the coverage
+    2. export          -> writes a filtered export file, fetched through /jobs/<id>/download
+    3. bulk_import     -> registers the accounts of an uploaded CSV / JSONL file
+At most CONCURRENCY[type] jobs of a type run at once across all processes, failed
+attempts are retried MAX_ATTEMPTS times with exponential backoff. Files left
+in STORAGE_DIR are removed FILE_TTL_SECONDS after they were written, unless a
+queued or running job still needs them.
+"""
+# Standard imports
+from flask import Response, send_file
+import datetime
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Custom imports
+from constants import db
+from models.job import Job, FAILED, QUEUED, RUNNING, SUCCEEDED
+from models.user import User
+from models.vaccination_summary import VaccinationSummary
+from service.account import _list_filters
+from service.bulk import _import_format, import_accounts
+from service.export import EXPORT_FORMATS, prepare_export
+from service.stats import coverage_stats, rebuild_summary
+from utils.exceptions import NotFoundError, ParameterError, UserUnauthorizedError
+
+LOG = logging.getLogger("root")
+
+settings = {
+    "ENABLED": True,
+    "THREADS": 2,
+    "POLL_SECONDS": 2,
+    "MAX_ATTEMPTS": 3,
+    "RETRY_BACKOFF_SECONDS": 30,
+    "STALE_SECONDS": 600,
+    "CONCURRENCY": {"recompute_stats": 1, "export": 2, "bulk_import": 1},
+    "STORAGE_DIR": "/tmp/vmp_jobs",
+    "FILE_TTL_SECONDS": 86400,
+    "SWEEP_SECONDS": 3600,
+}
+HANDLERS = {}
+_worker = None
+
+
+class JobSuperseded(Exception):
+    """Raised by progress() once the job was claimed again by another worker"""
+
+
+def configure(config):
+    """
+    Applies the JOBS config section
+    """
+    settings.update(config or {})
+
+
+def job_handler(job_type, validate=None, cleanup=None):
+    """
+    Registers handler(job, params, progress) -> result as the runner of a job
+    type. validate(details, params) checks the params when the job is queued,
+    cleanup(params) runs once the job failed for good.
+    """
+
+    def register(handler):
+        HANDLERS[job_type] = (handler, validate, cleanup)
+        return handler
+
+    return register
+
+
+def _storage_path(name):
+    os.makedirs(settings["STORAGE_DIR"], exist_ok=True)
+    return os.path.join(settings["STORAGE_DIR"], name)
+
+
+def sweep_storage():
+    """
+    Removes the files of STORAGE_DIR older than FILE_TTL_SECONDS: expired
+    exports, partial files and the uploads of jobs that are gone
+    """
+    directory = settings["STORAGE_DIR"]
+    if not os.path.isdir(directory):
+        return 0
+    pending = {
+        json.loads(params or "{}").get("upload") for (params,) in
+        db.session.query(Job.params).filter(Job.type == "bulk_import", Job.status.in_([QUEUED, RUNNING]))
+    }
+    db.session.commit()
+    cutoff = time.time() - settings["FILE_TTL_SECONDS"]
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name not in pending and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            # swept by another process sharing the directory
+            continue
+    if removed:
+        LOG.info("Removed {} expired job files".format(removed))
+    return removed
+
+
+@job_handler("recompute_stats")
+def _recompute_stats(job, params, progress):
+    progress(0)
+    if VaccinationSummary.enabled:
+        rebuild_summary()
+        progress(50)
+        return coverage_stats(VaccinationSummary.grouped_counts())
+    return coverage_stats(User.grouped_counts())
+
+
+def _export_details(job, params):
+    creator = User.fetch_user({"id": job.created_by}) if job.created_by is not None else None
+    return {"params": dict(params), "email": creator.email if creator else None, "account_type": "admin"}
+
+
+def _validate_export(details, params):
+    if (params.get("format") or "csv").lower() not in EXPORT_FORMATS:
+        raise ParameterError(message="format must be one of {}".format(", ".join(EXPORT_FORMATS)))
+    filters = {k: v for k, v in params.items() if k not in ("format", "gzip", "fields")}
+    _list_filters({"params": filters, "email": details.get("email")})
+
+
+@job_handler("export", validate=_validate_export)
+def _export(job, params, progress):
+    details = _export_details(job, params)
+    filters = {k: v for k, v in params.items() if k not in ("format", "gzip", "fields")}
+    total = User.count(_list_filters({"params": filters, "email": details["email"]})[0])
+    written = {"rows": 0}
+
+    def on_chunk(rows):
+        written["rows"] += rows
+        progress(written["rows"] * 100 // total if total else None)
+
+    body, mimetype, extension = prepare_export(details, on_chunk=on_chunk)
+    name = "job-{}.{}".format(job.id, extension)
+    path = _storage_path(name)
+    size = 0
+    with open(path + ".part", "wb") as output:
+        for part in body:
+            output.write(part)
+            size += len(part)
+    os.replace(path + ".part", path)
+    return {"file": name, "mimetype": mimetype, "rows": written["rows"], "bytes": size}
+
+
+def _remove_upload(params):
+    try:
+        os.remove(_storage_path(params["upload"]))
+    except FileNotFoundError:
+        pass
+
+
+@job_handler("bulk_import", cleanup=_remove_upload)
+def _bulk_import(job, params, progress):
+    job_id, worker, attempt = job.id, job.worker, job.attempts
+    # a retried import carries on after the rows its earlier attempts committed
+    resume = json.loads(job.result) if job.result else None
+
+    def checkpoint(state):
+        if not Job.checkpoint(job_id, worker, attempt, state):
+            raise JobSuperseded()
+
+    path = _storage_path(params["upload"])
+    size = os.path.getsize(path)
+    with open(path, "rb") as upload:
+        result = import_accounts(
+            upload, params["format"],
+            on_batch=lambda rows: progress(upload.tell() * 100 // size if size else None),
+            resume=resume, before_commit=checkpoint,
+        )
+    _remove_upload(params)
+    return result
+
+
+def _accepted(job):
+    if _worker is not None:
+        _worker.wake()
+    response = Response(
+            response=json.dumps(obj={"job_id": job.id, "status": job.status}),
+            status=202,
+            mimetype="application/json",
+            headers={"Location": "/jobs/{}".format(job.id)},
+        )
+    return response
+
+
+def create_job(details, body):
+    """
+    Queues a job of the given type, admin only
+    """
+    if details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    body = body if isinstance(body, dict) else {}
+    job_type = body.get("type")
+    if job_type not in HANDLERS or job_type == "bulk_import":
+        queueable = sorted(t for t in HANDLERS if t != "bulk_import")
+        raise ParameterError(message="type must be one of {}".format(", ".join(queueable)))
+    params = body.get("params") or {}
+    if not isinstance(params, dict):
+        raise ParameterError(message="params must be a JSON object")
+    validate = HANDLERS[job_type][1]
+    if validate is not None:
+        validate(details, dict(params))
+    job = Job.enqueue(job_type, params, created_by=details.get("id"), max_attempts=settings["MAX_ATTEMPTS"])
+    return _accepted(job)
+
+
+def create_import_job(details, stream, filename=None, mimetype=None, requested_format=None):
+    """
+    Stores an uploaded CSV / JSONL file and queues its import, admin only
+    """
+    if details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    fmt = _import_format(filename, mimetype, requested_format)
+    upload = "upload-{}.{}".format(uuid.uuid4().hex, fmt)
+    with open(_storage_path(upload), "wb") as output:
+        shutil.copyfileobj(stream, output)
+    job = Job.enqueue(
+        "bulk_import", {"upload": upload, "format": fmt},
+        created_by=details.get("id"), max_attempts=settings["MAX_ATTEMPTS"],
+    )
+    return _accepted(job)
+
+
+def _fetch_job(details, job_id):
+    job = db.session.query(Job).get(job_id)
+    if job is None:
+        return None
+    if details.get("account_type") != "admin" and job.created_by != details.get("id"):
+        return None
+    return job
+
+
+def fetch_job(details, job_id):
+    """
+    Returns the status, progress and result of a job
+    """
+    job = _fetch_job(details, job_id)
+    if job is None:
+        LOG.warning("Job not found {}".format(job_id))
+        return NotFoundError()
+    response = Response(
+            response=json.dumps(obj=job.to_response_dict()),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def download_job_file(details, job_id):
+    """
+    Sends the file written by a succeeded export job
+    """
+    job = _fetch_job(details, job_id)
+    result = json.loads(job.result) if job is not None and job.status == SUCCEEDED and job.result else {}
+    if "file" not in result or not os.path.exists(_storage_path(result["file"])):
+        LOG.warning("No file for job {}, or it expired".format(job_id))
+        return NotFoundError()
+    return send_file(
+        _storage_path(result["file"]),
+        mimetype=result["mimetype"],
+        as_attachment=True,
+        download_name=result["file"],
+    )
+
+
+class JobWorker:
+    """
+    Worker threads of one process. Job.claim enforces the per type
+    concurrency limits across processes, claims are also serialized within
+    the process for databases without advisory locks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.name = "{}:{}".format(socket.gethostname(), os.getpid())
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._swept_at = 0
+
+    def start(self):
+        for index in range(settings["THREADS"]):
+            threading.Thread(target=self._loop, name="job-worker-{}".format(index), daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _claim(self):
+        stale_after = datetime.timedelta(seconds=settings["STALE_SECONDS"])
+        limits = {job_type: settings["CONCURRENCY"].get(job_type, 1) for job_type in HANDLERS}
+        with self._lock:
+            return Job.claim(limits, self.name, stale_after)
+
+    def _sweep(self):
+        with self._lock:
+            if time.time() - self._swept_at < settings["SWEEP_SECONDS"]:
+                return
+            self._swept_at = time.time()
+        try:
+            sweep_storage()
+        except (OSError, SQLAlchemyError) as e:
+            db.session.rollback()
+            LOG.warning("Job storage sweep failed - {}".format(e))
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    self._sweep()
+                    job = self._claim()
+                    if job is not None:
+                        self._run(job)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    LOG.warning("Job worker failed to claim - {}".format(e))
+                    job = None
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._wake.wait(settings["POLL_SECONDS"])
+                self._wake.clear()
+
+    def _keep_alive(self, beat, stopped):
+        # handlers can go longer than STALE_SECONDS between progress calls,
+        # e.g. in a single large query
+        with self.app.app_context():
+            while not stopped.wait(settings["STALE_SECONDS"] / 4):
+                try:
+                    if not beat():
+                        return
+                except SQLAlchemyError as e:
+                    LOG.warning("Job heartbeat failed - {}".format(e))
+
+    def _run(self, job):
+        job_id, job_type, attempt = job.id, job.type, job.attempts
+        handler, _, cleanup = HANDLERS[job_type]
+        params = json.loads(job.params or "{}")
+        LOG.info("Running {} job {} (attempt {})".format(job_type, job_id, attempt))
+
+        def beat(percent=None):
+            return Job.heartbeat(job_id, self.name, attempt, percent)
+
+        def progress(percent=None):
+            if not beat(percent):
+                raise JobSuperseded()
+
+        stopped = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(beat, stopped), daemon=True).start()
+        try:
+            result = handler(job, params, progress)
+            finished = Job.finish(job_id, self.name, attempt, result=result)
+        except JobSuperseded:
+            db.session.rollback()
+            finished = None
+        except Exception as e:
+            db.session.rollback()
+            LOG.warning("{} job {} failed - {}".format(job_type, job_id, e), exc_info=True)
+            backoff = datetime.timedelta(seconds=settings["RETRY_BACKOFF_SECONDS"] * 2 ** (attempt - 1))
+            finished = Job.finish(job_id, self.name, attempt, error=str(e) or type(e).__name__, retry_in=backoff)
+        finally:
+            stopped.set()
+        if finished is None:
+            LOG.warning("{} job {} attempt {} was claimed again, its outcome is dropped".format(job_type, job_id, attempt))
+        elif finished.status == FAILED and cleanup is not None:
+            cleanup(params)
+
+
+def start(app):
+    """
+    Starts the job worker threads of this process, returns None when disabled
+    """
+    global _worker
+    if not settings["ENABLED"]:
+        return None
+    _worker = JobWorker(app)
+    _worker.start()
+    return _worker
@@ -0,0 +1,86 @@
+# Standard imports
+from flask import Response
+import json
+
+# Custom imports
+from constants import db
+from models.user import User
+from utils import http_cache, metrics
+from utils.db_pool import pool_stats as engine_pool_stats
+from utils.replicas import replica_stats
+from utils.exceptions import UserUnauthorizedError
+
+
+def _cache_samples():
+    samples = [
+        ({"cache": "user", "result": "hit"}, User.cache_stats.hits),
+        ({"cache": "user", "result": "miss"}, User.cache_stats.misses),
+    ]
+    if http_cache.response_cache is not None:
+        stats = http_cache.stats
+        samples += [
+            ({"cache": "response", "result": "hit"}, stats.hits),
+            ({"cache": "response", "result": "miss"}, stats.misses),
+        ]
+    return samples
+
+
+def _pool_samples():
+    engines = dict(replica_stats(db), primary=engine_pool_stats(db.get_engine()))
+    return [
+        ({"engine": engine, "stat": key}, float(value))
+        for engine, stats in engines.items()
+        for key, value in stats.items()
+        if key != "pool" and value is not None
+    ]
+
+
+metrics.REGISTRY.gauge("cache_lookups", "Cache lookups by cache and result", _cache_samples)
+metrics.REGISTRY.gauge("db_pool", "Database connection pool statistics", _pool_samples)
+
+
+def cache_stats(request_details):
+    """
+    Returns the user cache counters, i.e. the DB round trips saved so far
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    data = {"enabled": User.cache is not None}
+    data.update(User.cache_stats.to_dict())
+    if User.cache is not None:
+        data["size"] = User.cache.size()
+    response = Response(
+            response=json.dumps(obj=data),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def pool_stats(request_details):
+    """
+    Returns live statistics of the primary and replica connection pools
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    data = {"primary": engine_pool_stats(db.get_engine()), "replicas": replica_stats(db)}
+    response = Response(
+            response=json.dumps(obj=data),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def exposition(request_details):
+    """
+    Returns every metric in the Prometheus text format
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    response = Response(
+            response=metrics.REGISTRY.render(),
+            status=200,
+            mimetype="text/plain; version=0.0.4"
+        )
+    return response
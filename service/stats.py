@@ -0,0 +1,49 @@
+# Standard imports
+from flask import Response
+import json
+
+# Custom imports
+from models.user import User
+from models.vaccination_summary import GROUP_COLUMNS, VaccinationSummary
+from utils.exceptions import UserUnauthorizedError
+
+
+def coverage_stats(grouped_counts):
+    """
+    Folds {group key: count} into per dimension counts
+    """
+    data = {"total": 0}
+    data.update({column: {} for column in GROUP_COLUMNS})
+    for key, count in grouped_counts.items():
+        data["total"] += count
+        for column, value in zip(GROUP_COLUMNS, key):
+            value = value or "unknown"
+            data[column][value] = data[column].get(value, 0) + count
+    return data
+
+
+def vaccination_stats(request_details):
+    """
+    Returns vaccination coverage counts by gender, age band, vaccine and dose status
+    """
+    if request_details.get("account_type") != "admin":
+        return UserUnauthorizedError()
+    if VaccinationSummary.enabled:
+        data = coverage_stats(VaccinationSummary.grouped_counts())
+        data["source"] = "summary"
+    else:
+        data = coverage_stats(User.grouped_counts())
+        data["source"] = "live"
+    response = Response(
+            response=json.dumps(obj=data),
+            status=200,
+            mimetype="application/json"
+        )
+    return response
+
+
+def rebuild_summary():
+    """
+    Recomputes the coverage summary table from the User table
+    """
+    VaccinationSummary.rebuild(User.grouped_counts)
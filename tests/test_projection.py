@@ -0,0 +1,68 @@
+"""
+Smoke test of the fields= projections: models.user imports and the projected
+reads run on SQLite. Run with python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from constants import db
+from models.user import User
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{}".format(self.path)
+        self.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [{
+            "email": "asha@example.com",
+            "password": "x",
+            "name": "Asha",
+            "gender": "Female",
+            "age": 34,
+            "phone_number": "9000000000",
+            "account_type": "user",
+            "first_doze_taken": "No",
+            "second_doze_taken": "No",
+            "is_fully_vaccinated": "No",
+        }])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        os.remove(self.path)
+
+    def test_field_sets(self):
+        self.assertEqual(
+            User.ACCOUNT_FIELDS, tuple(f for f in User.RESPONSE_FIELDS if f not in User.VACCINE_FIELDS)
+        )
+
+    def test_projected_page(self):
+        rows = User.fetch_page([User.email == "asha@example.com"], 10, fields=User.ACCOUNT_FIELDS)
+        self.assertEqual(len(rows), 1)
+        projected = User.project(User.ACCOUNT_FIELDS, rows[0])
+        self.assertEqual(tuple(projected), User.ACCOUNT_FIELDS)
+        self.assertEqual(projected["name"], "Asha")
+        self.assertNotIn("vaccine_name", projected)
+
+    def test_projected_serializer(self):
+        rows = User.fetch_page([], 10, fields=("name", "age"))
+        self.assertEqual(User.row_serializer(("name", "age"))(rows[0]), '{"name":"Asha","age":34}')
+
+
+if __name__ == "__main__":
+    unittest.main()
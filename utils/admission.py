@@ -0,0 +1,184 @@
+"""
+Admission control for the bcrypt bound endpoints (login / register).
+A request is admitted only if
+    1. the token bucket of the client IP has a token
+    2. the token bucket of the email in the payload has a token
+    3. fewer than MAX_CONCURRENT requests of the process are in flight
+otherwise it is answered at once with 429 (rate limited) or 503 (busy) and a
+Retry-After header instead of queueing behind the password hashing pool.
+Buckets live in memory per process, or in a redis compatible server when
+several processes / hosts must share the limits.
+"""
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from decorator import decorator
+from flask import Response, request
+
+from utils.metrics import ADMISSION_REJECTIONS
+
+settings = {
+    "ENABLED": True,
+    "BACKEND": "memory",
+    "URL": "redis://localhost:6379/0",
+    "PREFIX": "vmp:admission",
+    "MAX_KEYS": 100000,
+    "PER_IP": {"RATE": 5, "BURST": 20},
+    "PER_EMAIL": {"RATE": 0.2, "BURST": 5},
+    "MAX_CONCURRENT": 8,
+    "RETRY_AFTER": 1,
+    "TRUST_FORWARDED_FOR": False,
+}
+limiter = None
+_in_flight = None
+
+
+class MemoryLimiter:
+    """
+    Token buckets of one process. The least recently used buckets are dropped
+    past max_keys, a dropped bucket simply starts full again.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst):
+        """
+        Takes a token from the bucket of key, returns 0 when admitted or the
+        seconds until a token is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+# Refills and takes a token atomically, returns the wait in milliseconds
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RedisLimiter:
+    """
+    Token buckets shared between processes, backed by any redis compatible
+    server supporting EVALSHA. Bucket updates run as one script, so
+    concurrent requests never take the same token twice.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="vmp:admission", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("redis package is required for the redis admission backend")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, key, rate, burst):
+        now = int(time.time() * 1000)
+        wait = self._script(keys=["{}:{}".format(self.prefix, key)], args=[rate, burst, now])
+        return int(wait) / 1000
+
+
+def configure(config):
+    """
+    Applies the ADMISSION_CONTROL config section
+    """
+    global limiter, _in_flight
+    settings.update(config or {})
+    if settings["BACKEND"] == "memory":
+        limiter = MemoryLimiter(max_keys=settings["MAX_KEYS"])
+    elif settings["BACKEND"] == "redis":
+        limiter = RedisLimiter(url=settings["URL"], prefix=settings["PREFIX"])
+    else:
+        raise ValueError("Unknown admission backend {}".format(settings["BACKEND"]))
+    _in_flight = threading.BoundedSemaphore(settings["MAX_CONCURRENT"])
+
+
+def client_ip():
+    if settings["TRUST_FORWARDED_FOR"] and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+
+def _reject(endpoint, reason, status, message, retry_after):
+    ADMISSION_REJECTIONS.inc(endpoint, reason)
+    return Response(
+        response=json.dumps(obj={"message": message, "success": False}),
+        status=status,
+        mimetype="application/json",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def _rate_limited(endpoint, params):
+    """
+    Returns the rejection response of the first exhausted bucket, if any
+    """
+    checks = [("ip", client_ip(), settings["PER_IP"])]
+    email = params.get("email")
+    if isinstance(email, str) and email:
+        checks.append(("email", email.lower(), settings["PER_EMAIL"]))
+    for reason, value, limit in checks:
+        if not limit:
+            continue
+        key = "{}:{}:{}".format(endpoint, reason, value)
+        wait = limiter.acquire(key, limit["RATE"], limit["BURST"])
+        if wait:
+            return _reject(endpoint, reason, 429, "Too many attempts, try again later", wait)
+    return None
+
+
+def admission_control(endpoint):
+    """
+    A decorator which sheds the request when the caller is over its rate or
+    the process is at its concurrency limit. Expects the validated params.
+    """
+
+    def admit(function, *args, **kwargs):
+        if not settings["ENABLED"] or limiter is None:
+            return function(*args, **kwargs)
+        rejected = _rate_limited(endpoint, kwargs.get("params") or {})
+        if rejected is not None:
+            return rejected
+        if not _in_flight.acquire(blocking=False):
+            return _reject(endpoint, "concurrency", 503, "Server busy, try again", settings["RETRY_AFTER"])
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _in_flight.release()
+
+    return decorator(admit)
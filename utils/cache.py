@@ -0,0 +1,150 @@
+"""
+Cache backends shared across the application.
+    1. MemoryCache - in-process LRU cache with a TTL per entry, only correct
+       when a single process serves the writes
+    2. RedisCache - shared cache for multiple processes / hosts
+Both expose get, set, delete and clear. Hits and misses are counted with
+CacheStats by the users of a cache, per logical lookup, since one lookup
+can take several gets.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheStats:
+    """Thread safe hit / miss counters of a cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryCache:
+    """In-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry:
+                    del self._data[key]
+                value = None
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Cache shared between processes, backed by any redis compatible server.
+    Values are stored as JSON under a namespace, clear() bumps the namespace
+    generation instead of scanning keys.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", ttl=300, prefix="vmp", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("redis package is required for the redis cache backend")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _generation(self):
+        return int(self.client.get("{}:generation".format(self.prefix)) or 0)
+
+    def _key(self, key, generation=None):
+        if generation is None:
+            generation = self._generation()
+        return "{}:{}:{}".format(self.prefix, generation, key)
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self._key(key), json.dumps(value), ex=self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            generation = self._generation()
+            self.client.delete(*[self._key(k, generation) for k in keys])
+
+    def clear(self):
+        self.client.incr("{}:generation".format(self.prefix))
+
+    def size(self):
+        return None
+
+
+def is_process_local(config):
+    """
+    Tells if a cache config keeps its entries in the process, where writes
+    served by other processes cannot invalidate them
+    """
+    return (config or {}).get("BACKEND", "memory") == "memory"
+
+
+def create_cache(config):
+    """
+    Builds a cache backend from its config section, returns None when disabled
+    """
+    config = config or {}
+    backend = config.get("BACKEND", "memory")
+    if backend == "memory":
+        return MemoryCache(max_size=config.get("MAX_SIZE", 10000), ttl=config.get("TTL", 300))
+    if backend == "redis":
+        return RedisCache(
+            url=config.get("URL", "redis://localhost:6379/0"),
+            ttl=config.get("TTL", 300),
+            prefix=config.get("PREFIX", "vmp"),
+        )
+    if backend == "none":
+        return None
+    raise ValueError("Unknown cache backend {}".format(backend))
@@ -0,0 +1,205 @@
+"""
+Response compression negotiated through Accept-Encoding.
+    1. br (when the brotli package is installed), gzip and deflate, in the
+       server preference of ALGORITHMS among the encodings the client accepts
+    2. only MIMETYPES responses of at least MIN_SIZE bytes are compressed
+    3. streamed responses are compressed chunk by chunk and flushed after
+       every chunk, so they keep streaming
+Compressed responses get "-<encoding>" appended to their ETag, as the bytes
+differ from the identity representation, and "Vary: Accept-Encoding".
+"""
+import time
+import zlib
+
+from flask import request
+
+from utils.metrics import COMPRESSION_BYTES, COMPRESSION_SECONDS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+settings = {
+    "ENABLED": True,
+    "ALGORITHMS": ["br", "gzip", "deflate"],
+    "MIN_SIZE": 1024,
+    "LEVEL": 6,
+    "BROTLI_QUALITY": 4,
+    "MIMETYPES": ["application/json", "application/x-ndjson", "text/csv", "text/plain"],
+}
+ETAG_SUFFIXES = ("-br", "-gzip", "-deflate")
+
+
+class _ZlibCompressor:
+    def __init__(self, wbits, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compressor(encoding, level=None):
+    """
+    Returns a streaming compressor for the given content coding, level
+    defaults to LEVEL (BROTLI_QUALITY for br)
+    """
+    if encoding == "gzip":
+        return _ZlibCompressor(16 + zlib.MAX_WBITS, settings["LEVEL"] if level is None else level)
+    if encoding == "deflate":
+        return _ZlibCompressor(zlib.MAX_WBITS, settings["LEVEL"] if level is None else level)
+    if encoding == "br" and brotli is not None:
+        return _BrotliCompressor(settings["BROTLI_QUALITY"] if level is None else level)
+    raise ValueError("Unsupported encoding {}".format(encoding))
+
+
+def available_encodings():
+    return [e for e in settings["ALGORITHMS"] if e != "br" or brotli is not None]
+
+
+def configure(config):
+    """
+    Applies the COMPRESSION config section
+    """
+    settings.update(config or {})
+
+
+def _negotiate():
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def _compressible(response):
+    return (
+        200 <= response.status_code < 300
+        and response.status_code not in (204, 206)
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in settings["MIMETYPES"]
+    )
+
+
+class _Meter:
+    """Accumulates the bytes and CPU time of compressing one response"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def run(self, operation, data=None):
+        started = time.thread_time()
+        output = operation(data) if data is not None else operation()
+        self.seconds += time.thread_time() - started
+        self.bytes_in += len(data) if data is not None else 0
+        self.bytes_out += len(output)
+        return output
+
+    def record(self):
+        COMPRESSION_BYTES.inc(self.encoding, "in", amount=self.bytes_in)
+        COMPRESSION_BYTES.inc(self.encoding, "out", amount=self.bytes_out)
+        COMPRESSION_SECONDS.observe(self.seconds, self.encoding)
+
+
+def _compress_stream(chunks, encoding, close):
+    meter = _Meter(encoding)
+    engine = compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                yield meter.run(engine.compress, chunk) + meter.run(engine.flush)
+        yield meter.run(engine.finish)
+    finally:
+        meter.record()
+        if close is not None:
+            close()
+
+
+def _peek(response):
+    """
+    Reads a streamed body until MIN_SIZE bytes, returns (head, rest) where
+    rest is None when the whole body fit
+    """
+    chunks = iter(response.response)
+    head, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        head.append(chunk)
+        size += len(chunk)
+        if size >= settings["MIN_SIZE"]:
+            return head, chunks
+    return head, None
+
+
+def _chain(head, rest):
+    yield from head
+    yield from rest
+
+
+def _mark(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag("{}-{}".format(etag, encoding), weak)
+
+
+def _compress(response):
+    response.vary.add("Accept-Encoding")
+    if not settings["ENABLED"] or not _compressible(response):
+        return response
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        head, rest = _peek(response)
+        if rest is None:
+            # small after all, send it as a plain body
+            response.set_data(b"".join(head))
+            return response
+        close = getattr(response.response, "close", None)
+        response.response = _compress_stream(_chain(head, rest), encoding, close)
+        response.headers.pop("Content-Length", None)
+        _mark(response, encoding)
+        return response
+
+    data = response.get_data()
+    if len(data) < settings["MIN_SIZE"]:
+        return response
+    meter = _Meter(encoding)
+    engine = compressor(encoding)
+    response.set_data(meter.run(engine.compress, data) + meter.run(engine.finish))
+    meter.record()
+    _mark(response, encoding)
+    return response
+
+
+def init_app(app):
+    """
+    Compresses the responses of the app after every other after_request hook
+    """
+    # after_request hooks run in reverse registration order, run this one last
+    app.after_request_funcs.setdefault(None, []).insert(0, _compress)
@@ -0,0 +1,109 @@
+"""
+Database connection pool configuration and statistics.
+DB_CONNECTION_POOL (config.json) is either the pool size or a section with
+SIZE, MAX_OVERFLOW, TIMEOUT, RECYCLE, PRE_PING and PGBOUNCER. In PgBouncer mode
+the application keeps no pool of its own and leaves pooling to PgBouncer.
+"""
+import threading
+import time
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+POOL_DEFAULTS = {
+    "SIZE": 5,
+    "MAX_OVERFLOW": 10,
+    "TIMEOUT": 30,
+    "RECYCLE": 1800,
+    "PRE_PING": True,
+    "PGBOUNCER": False,
+}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def wait_stats(self):
+        with self._stats_lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+
+def pool_config(config):
+    settings = dict(POOL_DEFAULTS)
+    if isinstance(config, dict):
+        settings.update(config)
+    elif config:
+        settings["SIZE"] = config
+    return settings
+
+
+def engine_options(config, uri=""):
+    """
+    Translates DB_CONNECTION_POOL into create_engine keyword arguments
+    """
+    settings = pool_config(config)
+    if settings["PGBOUNCER"]:
+        return {"poolclass": NullPool}
+    options = {}
+    if uri.startswith("sqlite"):
+        # pooled SQLite connections are handed to whichever thread checks them out
+        options["connect_args"] = {"check_same_thread": False}
+        if make_url(uri).database in (None, "", ":memory:"):
+            # keeps Flask-SQLAlchemy's StaticPool, every other connection would open its own empty database
+            return options
+    return dict(options, **{
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings["SIZE"],
+        "max_overflow": settings["MAX_OVERFLOW"],
+        "pool_timeout": settings["TIMEOUT"],
+        "pool_recycle": settings["RECYCLE"],
+        "pool_pre_ping": settings["PRE_PING"],
+    })
+
+
+def pool_stats(engine):
+    """
+    Live statistics of the pool of an engine
+    """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
@@ -5,12 +5,14 @@ import functools
 import jwt
 import os
 import json
+import time
 from flask import request, g, Response
 from decorator import decorator
 from jwt.exceptions import ExpiredSignatureError
 
 from models.user import User
 from utils.exceptions import NoAuthTokenPresentError, UserUnauthorizedError
+from utils.metrics import JWT_DECODE_SECONDS
 
 
 @decorator
@@ -22,6 +24,7 @@ def decode_auth_token(f, is_req=False, *args, **kwargs):
     if "AUTHORIZATION" in request.headers or "auth_token" in request.view_args:
         auth_token = request.headers.get('AUTHORIZATION') or request.view_args.get('auth_token')
         if auth_token:
+            started = time.perf_counter()
             try:
                 payload = jwt.decode(auth_token, os.getenv("SECRET_KEY"), "HS256")
             except ExpiredSignatureError:
@@ -32,13 +35,23 @@ def decode_auth_token(f, is_req=False, *args, **kwargs):
                     status=400,
                     mimetype="application/json"
                 )
+            finally:
+                JWT_DECODE_SECONDS.observe(time.perf_counter() - started)
             email = payload["sub"]
-            user_obj = User.find_by_email(email=email)
-            if not user_obj:
-                raise UserUnauthorizedError(message="Authentication failed")
-            kwargs["id"] = user_obj.id
-            kwargs["account_type"] = user_obj.account_type
+            if "id" in payload and "tev" in payload:
+                # self-contained token, only check it was not revoked since
+                user_id, account_type = payload["id"], payload["account_type"]
+                if User.token_epochs.is_revoked(user_id, payload["tev"]):
+                    raise UserUnauthorizedError(message="Token revoked, login again")
+            else:
+                # tokens issued before the claims were added
+                user_obj = User.find_by_email(email=email, use_cache=False)
+                if not user_obj:
+                    raise UserUnauthorizedError(message="Authentication failed")
+                user_id, account_type = user_obj.id, user_obj.account_type
+            kwargs["id"] = user_id
+            kwargs["account_type"] = account_type
             kwargs["email"] = email
-            g.user_id = user_obj.id
+            g.user_id = user_id
         return f(*args, **kwargs)
     raise NoAuthTokenPresentError
\ No newline at end of file
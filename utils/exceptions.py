@@ -82,3 +82,12 @@ class AuthError(Exception):
         self.message = message
         super().__init__(self.message)
         return abort(401, error=self.message, success=False)
+
+
+class ServiceUnavailableError(Exception):
+    """Raise for errors when the server is too busy to handle the request."""
+
+    def __init__(self, message="Service temporarily unavailable, try again"):
+        self.message = message
+        super().__init__(self.message)
+        return abort(503, error=self.message, success=False)
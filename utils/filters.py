@@ -0,0 +1,155 @@
+"""
+Filter language for listing users.
+Predicates come either as query params or as a JSON "where" tree:
+    1. query params   -> field=value, field__op=value (ANDed), lists are comma separated
+    2. where tree     -> {"and": [...]}, {"or": [...]}, {"not": {...}}
+                         or {"field": "age", "op": "between", "value": [45, 60]}
+Operators: eq, ne, lt, lte, gt, gte, in, not_in, between, is_null.
+Lists take at most MAX_FILTER_VALUES values, a where node holding and / or /
+not takes no other key.
+Everything compiles to one SQLAlchemy criterion over whitelisted columns so
+the database can use its indexes.
+"""
+import json
+from datetime import date
+
+from sqlalchemy import and_, asc, desc, not_, or_
+
+from constants import MAX_FILTER_PREDICATES, MAX_FILTER_VALUES
+from utils.exceptions import ParameterError
+
+OPERATORS = {
+    "eq": lambda column, value: column.is_(None) if value is None else column == value,
+    "ne": lambda column, value: column.isnot(None) if value is None else column != value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "in": lambda column, value: column.in_(value),
+    "not_in": lambda column, value: column.notin_(value),
+    "between": lambda column, value: column.between(value[0], value[1]),
+    "is_null": lambda column, value: column.is_(None) if value else column.isnot(None),
+}
+LIST_OPERATORS = ("in", "not_in", "between")
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1", "yes"):
+        return True
+    if str(value).lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(value)
+
+
+def to_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def _convert(field, field_type, op, value):
+    """
+    Casts a raw query string / JSON value to the column type
+    """
+    converter = to_bool if op == "is_null" else field_type
+    try:
+        if op in LIST_OPERATORS:
+            values = value.split(",") if isinstance(value, str) else list(value)
+            if len(values) > MAX_FILTER_VALUES:
+                raise ParameterError(message="at most {} values allowed for {}__{}".format(MAX_FILTER_VALUES, field, op))
+            values = [converter(v) for v in values]
+            if op == "between" and len(values) != 2:
+                raise ValueError(value)
+            return values
+        return None if value is None else converter(value)
+    except (TypeError, ValueError):
+        raise ParameterError(message="invalid value for {}__{}: {}".format(field, op, value))
+
+
+class FilterCompiler:
+    """Compiles filter params and where trees for one model and its whitelisted fields"""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.predicates = 0
+
+    def predicate(self, field, op, value):
+        if field not in self.fields:
+            raise ParameterError(message="cannot filter on {}".format(field))
+        if op not in OPERATORS:
+            raise ParameterError(message="unknown operator {}".format(op))
+        self.predicates += 1
+        if self.predicates > MAX_FILTER_PREDICATES:
+            raise ParameterError(message="at most {} predicates allowed".format(MAX_FILTER_PREDICATES))
+        value = _convert(field, self.fields[field], op, value)
+        return OPERATORS[op](getattr(self.model, field), value)
+
+    def from_params(self, params):
+        criteria = []
+        for key, value in params.items():
+            field, _, op = key.partition("__")
+            criteria.append(self.predicate(field, op or "eq", value))
+        return criteria
+
+    def from_tree(self, node):
+        if not isinstance(node, dict):
+            raise ParameterError(message="where must be a JSON object")
+        logical = [key for key in ("and", "or", "not") if key in node]
+        if logical and len(node) > 1:
+            raise ParameterError(message="a where node with {} takes no other key".format(logical[0]))
+        if "and" in node or "or" in node:
+            children = node.get("and", node.get("or"))
+            if not isinstance(children, list) or not children:
+                raise ParameterError(message="and / or need a non empty list")
+            combine = and_ if "and" in node else or_
+            return combine(*[self.from_tree(child) for child in children])
+        if "not" in node:
+            return not_(self.from_tree(node["not"]))
+        return self.predicate(node.get("field"), node.get("op", "eq"), node.get("value"))
+
+
+def parse_where(where):
+    """
+    Accepts the where tree as a dict or as a JSON encoded query param
+    """
+    if where is None or isinstance(where, dict):
+        return where
+    try:
+        return json.loads(where)
+    except (TypeError, ValueError):
+        raise ParameterError(message="where must be valid JSON")
+
+
+def compile_filters(model, fields, params=None, where=None):
+    """
+    Returns the list of criteria (to be ANDed) for the given params and where tree
+    """
+    compiler = FilterCompiler(model, fields)
+    criteria = compiler.from_params(params or {})
+    where = parse_where(where)
+    if where:
+        criteria.append(compiler.from_tree(where))
+    return criteria
+
+
+def compile_sort(model, fields, sort):
+    """
+    Turns "-age,name" into ORDER BY age DESC, name ASC, id ASC.
+    Returns None for the default id order.
+    """
+    if not sort:
+        return None
+    order = []
+    for key in sort.split(","):
+        key = key.strip()
+        field = key.lstrip("-")
+        if field not in fields:
+            raise ParameterError(message="cannot sort on {}".format(field))
+        order.append(desc(getattr(model, field)) if key.startswith("-") else asc(getattr(model, field)))
+    if sort.strip() == "id":
+        return None
+    order.append(asc(model.id))
+    return order
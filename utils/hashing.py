@@ -0,0 +1,113 @@
+"""
+Password hashing helpers.
+bcrypt is CPU bound, so hashing and verification run in a dedicated process
+pool and request threads only wait on the result (with a timeout) instead of
+holding a worker busy for the whole hash.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+from utils.exceptions import ServiceUnavailableError
+from utils.metrics import PASSWORD_HASHING_SECONDS
+
+settings = {
+    "POOL_SIZE": 2,
+    "BCRYPT_ROUNDS": 12,
+    "TIMEOUT": 10,
+}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(config):
+    """
+    Applies the PASSWORD_HASHING config section. POOL_SIZE 0 hashes inline.
+    """
+    shutdown()
+    settings.update(config or {})
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings["POOL_SIZE"],
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _pool
+
+
+def shutdown():
+    """
+    Stops the worker processes, a new pool is created on next use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(password_hash, password):
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+def _run(operation, function, *args):
+    started = time.perf_counter()
+    try:
+        if not settings["POOL_SIZE"]:
+            return function(*args)
+        future = _get_pool().submit(function, *args)
+        try:
+            return future.result(timeout=settings["TIMEOUT"])
+        except TimeoutError:
+            future.cancel()
+            raise ServiceUnavailableError(message="Password hashing timed out, try again")
+    finally:
+        PASSWORD_HASHING_SECONDS.observe(time.perf_counter() - started, operation)
+
+
+def hash_password(password):
+    """
+    Returns the bcrypt hash of password
+    """
+    return _run("hash", _hash, password, settings["BCRYPT_ROUNDS"])
+
+
+def check_password(password_hash, password):
+    """
+    Tells if password matches the stored bcrypt hash
+    """
+    if not password_hash or not password:
+        return False
+    return bool(_run("check", _check, password_hash, password))
+
+
+def hash_passwords(passwords):
+    """
+    Hashes many passwords in parallel across the pool, keeping their order
+    """
+    rounds = settings["BCRYPT_ROUNDS"]
+    if not settings["POOL_SIZE"]:
+        return [_hash(password, rounds) for password in passwords]
+    pool_size = settings["POOL_SIZE"]
+    timeout = settings["TIMEOUT"] * max(1, -(-len(passwords) // pool_size))
+    try:
+        return list(_get_pool().map(
+            _hash,
+            passwords,
+            [rounds] * len(passwords),
+            chunksize=max(1, len(passwords) // (pool_size * 4)),
+            timeout=timeout,
+        ))
+    except TimeoutError:
+        raise ServiceUnavailableError(message="Password hashing timed out, try again")
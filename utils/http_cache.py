@@ -0,0 +1,68 @@
+"""
+Conditional GET helpers and the server side response cache.
+Responses are cached per user as {"<endpoint>:<fields>": [etag, body]} under a
+single key, so a write on the user drops every cached variant at once.
+"""
+import hashlib
+
+from flask import request
+
+from utils.cache import CacheStats, create_cache
+from utils.compression import ETAG_SUFFIXES
+
+response_cache = None
+stats = CacheStats()
+
+
+def configure(config):
+    """
+    Sets up the response cache from the RESPONSE_CACHE config section
+    """
+    global response_cache, stats
+    response_cache = create_cache(config)
+    stats = CacheStats()
+
+
+def make_etag(*parts):
+    """
+    Strong ETag of the representation identified by parts
+    """
+    return hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def get(user_id, variant):
+    if response_cache is None:
+        return None
+    variants = response_cache.get("resp:{}".format(user_id)) or {}
+    cached = variants.get(variant)
+    stats.record(cached is not None)
+    return cached
+
+
+def store(user_id, variant, etag, body):
+    if response_cache is None:
+        return
+    key = "resp:{}".format(user_id)
+    variants = response_cache.get(key) or {}
+    variants[variant] = [etag, body]
+    response_cache.set(key, variants)
+
+
+def invalidate(user_id=None):
+    """
+    Drops the cached responses of a user, or of everybody when no id is given
+    """
+    if response_cache is None:
+        return
+    if user_id is None:
+        response_cache.clear()
+    else:
+        response_cache.delete("resp:{}".format(user_id))
+
+
+def is_not_modified(etag):
+    """
+    Tells if the client already holds this representation (If-None-Match),
+    in any content coding
+    """
+    return any(request.if_none_match.contains_weak(etag + suffix) for suffix in ("",) + ETAG_SUFFIXES)
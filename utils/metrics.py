@@ -0,0 +1,207 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+    1. Counters and histograms with labels, cheap enough to leave on
+    2. Gauges computed by a callback at scrape time
+    3. Flask / SQLAlchemy hooks recording per route latency, status codes,
+       SQL statement counts and DB time
+Metrics are per process, with several server workers every worker reports its own.
+"""
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter per label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in values.items():
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    """Cumulative bucket histogram per label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in values.items():
+            label_dict = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", dict(label_dict, le=bound), cumulative
+            yield self.name + "_count", label_dict, cumulative
+            yield self.name + "_sum", label_dict, counts[-1]
+
+
+class Gauge:
+    """Gauge whose samples come from a callback returning [(labels, value)]"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield self.name, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency until the response is returned",
+    ("method", "route"),
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "http_requests_total", "Requests by route and status code", ("method", "route", "status"),
+)
+REQUEST_SQL_STATEMENTS = REGISTRY.histogram(
+    "http_request_sql_statements", "SQL statements executed per request", ("method", "route"),
+    buckets=COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = REGISTRY.histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request", ("method", "route"),
+)
+PASSWORD_HASHING_SECONDS = REGISTRY.histogram(
+    "password_hashing_seconds", "Time request threads spend waiting on bcrypt", ("operation",),
+)
+JWT_DECODE_SECONDS = REGISTRY.histogram("jwt_decode_seconds", "Time spent decoding auth tokens")
+COMPRESSION_BYTES = REGISTRY.counter(
+    "http_compression_bytes_total", "Response bytes before (in) and after (out) compression",
+    ("encoding", "direction"),
+)
+COMPRESSION_SECONDS = REGISTRY.histogram(
+    "http_compression_cpu_seconds", "CPU time spent compressing one response", ("encoding",),
+)
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "admission_rejections_total", "Requests shed by admission control", ("endpoint", "reason"),
+)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+def _after_request(response):
+    started = g.get("metrics_started")
+    if started is not None:
+        route = _route()
+        REQUEST_LATENCY.observe(time.perf_counter() - started, request.method, route)
+        REQUESTS_TOTAL.inc(request.method, route, response.status_code)
+        REQUEST_SQL_STATEMENTS.observe(g.sql_statements, request.method, route)
+        REQUEST_DB_SECONDS.observe(g.sql_seconds, request.method, route)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # on the execution context, which is dropped along with a statement that raises
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is not None and has_request_context() and "sql_statements" in g:
+        g.sql_statements += 1
+        g.sql_seconds += time.perf_counter() - started
+
+
+def init_app(app):
+    """
+    Installs the request and SQL instrumentation
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
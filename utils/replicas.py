@@ -0,0 +1,200 @@
+"""
+Read replica routing.
+DB_REPLICAS (config.json) lists replica URLs which become the SQLALCHEMY_BINDS
+replica_0 .. replica_N. Queries of GET requests on the routed namespaces go to
+one healthy replica per request, picked round-robin; everything else stays on
+the primary:
+    1. writes, and any query outside a request (CLI, jobs, benchmarks)
+    2. reads of a user who wrote within the last READ_YOUR_WRITES seconds
+    3. reads while no replica is healthy
+    4. reads filling the shared caches (on_primary), a lagging replica would
+       cache a row older than the last write for every reader
+Replicas are health checked (SELECT 1, replication lag on PostgreSQL) at
+most every HEALTH_CHECK_SECONDS by whichever request thread finds the check due.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.cache import create_cache
+from utils.db_pool import pool_stats
+
+LOG = logging.getLogger("root")
+
+READ_METHODS = ("GET", "HEAD")
+settings = {
+    "URLS": [],
+    "PATHS": ["/account", "/vaccines"],
+    "HEALTH_CHECK_SECONDS": 5,
+    "MAX_LAG_SECONDS": 30,
+    "READ_YOUR_WRITES": {"SECONDS": 5, "BACKEND": "memory"},
+}
+replicas = []
+recent_writes = None
+_counter = 0
+_counter_lock = threading.Lock()
+
+# NULL unless the server is a replica replaying WAL
+LAG_QUERY = text("SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())")
+
+
+class Replica:
+    """Health state of one replica bind"""
+
+    def __init__(self, name):
+        self.name = name
+        self.healthy = True
+        self.lag_seconds = None
+        self.checked_at = None
+        self._check_lock = threading.Lock()
+
+    def is_healthy(self, engine):
+        due = self.checked_at is None or time.monotonic() - self.checked_at >= settings["HEALTH_CHECK_SECONDS"]
+        # a single thread runs a due check, the others keep the last state
+        if due and self._check_lock.acquire(blocking=False):
+            try:
+                self.check(engine)
+            finally:
+                self._check_lock.release()
+        return self.healthy
+
+    def check(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                if engine.dialect.name == "postgresql":
+                    lag = connection.execute(LAG_QUERY).scalar()
+                    self.lag_seconds = float(lag) if lag is not None else None
+            healthy = self.lag_seconds is None or self.lag_seconds <= settings["MAX_LAG_SECONDS"]
+        except SQLAlchemyError as e:
+            LOG.warning("Replica {} failed its health check: {}".format(self.name, e))
+            healthy = False
+        if healthy != self.healthy:
+            LOG.warning("Replica {} is now {}".format(self.name, "healthy" if healthy else "unhealthy"))
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+
+
+def configure(config):
+    """
+    Applies the DB_REPLICAS config section, returns the SQLALCHEMY_BINDS to set
+    """
+    global replicas, recent_writes
+    settings.update(config or {})
+    replicas = [Replica("replica_{}".format(index)) for index in range(len(settings["URLS"]))]
+    window = settings["READ_YOUR_WRITES"]
+    recent_writes = create_cache(dict(window, TTL=window["SECONDS"], PREFIX="vmp:writes")) if window["SECONDS"] else None
+    return {replica.name: url for replica, url in zip(replicas, settings["URLS"])}
+
+
+def _is_routed_read():
+    return request.method in READ_METHODS and request.path.startswith(tuple(settings["PATHS"]))
+
+
+def _wrote_recently():
+    """
+    Whether the authenticated user is within its read-your-writes window.
+    Only known once decode_auth_token has set g.user_id.
+    """
+    if recent_writes is None:
+        return False
+    if "db_wrote_recently" not in g:
+        user_id = g.get("user_id")
+        if user_id is None:
+            return False
+        g.db_wrote_recently = recent_writes.get("write:{}".format(user_id)) is not None
+    return g.db_wrote_recently
+
+
+def _pick(db, app):
+    global _counter
+    healthy = [replica for replica in replicas if replica.is_healthy(db.get_engine(app, bind=replica.name))]
+    if not healthy:
+        return None
+    with _counter_lock:
+        _counter += 1
+        return healthy[_counter % len(healthy)]
+
+
+def replica_engine(db, app):
+    """
+    Returns the replica engine serving the current query, None for the primary
+    """
+    if not replicas or not has_request_context() or g.get("db_primary") or not _is_routed_read() or _wrote_recently():
+        return None
+    if "db_replica" not in g:
+        g.db_replica = _pick(db, app)
+    if g.db_replica is None:
+        return None
+    return db.get_engine(app, bind=g.db_replica.name)
+
+
+@contextmanager
+def on_primary(enabled=True):
+    """
+    Keeps the queries of the block on the primary when enabled
+    """
+    if not enabled or not has_request_context():
+        yield
+        return
+    previous = g.get("db_primary", False)
+    g.db_primary = True
+    try:
+        yield
+    finally:
+        g.db_primary = previous
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of the current request to a replica"""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing:
+            engine = replica_engine(self.db, self.app)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _record_write(response):
+    user_id = g.get("user_id")
+    if (
+        recent_writes is not None and user_id is not None
+        and request.method not in READ_METHODS and response.status_code < 400
+    ):
+        recent_writes.set("write:{}".format(user_id), True)
+    return response
+
+
+def init_app(app):
+    """
+    Starts the read-your-writes window of users after their successful writes
+    """
+    app.after_request(_record_write)
+
+
+def replica_stats(db, app=None):
+    """
+    Pool and health statistics of every replica
+    """
+    stats = {}
+    for replica in replicas:
+        data = pool_stats(db.get_engine(app, bind=replica.name))
+        data.update({"healthy": replica.healthy, "lag_seconds": replica.lag_seconds})
+        stats[replica.name] = data
+    return stats
@@ -0,0 +1,220 @@
+"""
+Fuzzy search over user name, email and phone number.
+On PostgreSQL the search runs in the database on pg_trgm GIN indexes. Other
+databases use SearchIndex, an in-memory trigram index of the live users:
+    1. built from the database on the first search
+    2. caught up before a search (at most every CATCH_UP_SECONDS, or right
+       away after a local write) with the users inserted or updated since the
+       last sync, so writes of other processes are picked up as well
+Trigrams follow pg_trgm: words are lower cased alphanumeric runs padded with
+two spaces in front and one behind, so both backends rank alike.
+"""
+import datetime
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+
+from constants import CLOCK_SKEW
+
+settings = {
+    "BACKEND": "auto",
+    "MIN_QUERY_LENGTH": 2,
+    "SIMILARITY_THRESHOLD": 0.3,
+    "CATCH_UP_SECONDS": 1,
+    "MAX_CANDIDATES": 1000,
+    # PostgreSQL only, budget of the trigram lookup run when substring matches do not fill the page
+    "FUZZY_TIMEOUT_MS": 200,
+    # grams shared by more users than this carry no signal for fuzzy matching
+    "MAX_FUZZY_POSTING": 20000,
+}
+backend = "memory"
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def configure(config, uri=""):
+    """
+    Applies the SEARCH config section, auto picks postgres for PostgreSQL URIs
+    """
+    global backend
+    settings.update(config or {})
+    backend = settings["BACKEND"]
+    if backend == "auto":
+        backend = "postgres" if uri.startswith("postgres") else "memory"
+
+
+def words(text):
+    return WORD.findall(text.lower()) if text else []
+
+
+def trigrams(text):
+    """
+    The padded trigrams of every word of text, as pg_trgm extracts them
+    """
+    grams = set()
+    for word in words(text):
+        padded = "  {} ".format(word)
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def substring_grams(text):
+    """
+    Trigrams every text containing text as a substring has, prefix only for
+    words shorter than 3 characters
+    """
+    grams = set()
+    for word in words(text):
+        if len(word) < 3:
+            grams.add(" " + word[:2] if len(word) == 2 else "  " + word)
+        else:
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def similarity(query_grams, text):
+    """
+    Trigram similarity of a lower cased text, shared grams are found by
+    substring tests on the padded words instead of building the gram set
+    """
+    text_words = words(text)
+    padded = "".join(["  {} ".format(word) for word in text_words])
+    shared = sum([1 for gram in query_grams if gram in padded])
+    total = sum([len(word) + 1 for word in text_words])
+    return shared / (len(query_grams) + total - shared) if shared else 0.0
+
+
+def score(query, query_grams, texts):
+    """
+    Best trigram similarity over the lower cased texts, +1 for a substring
+    match and +0.5 more when a text starts with the query
+    """
+    best = 0.0
+    for text in texts:
+        if not text:
+            continue
+        value = similarity(query_grams, text)
+        if query in text:
+            value += 1.0
+            if text.startswith(query):
+                value += 0.5
+        best = max(best, value)
+    return best
+
+
+class NgramIndex:
+    """Trigram postings of documents made of a few short texts"""
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+
+    def add(self, doc_id, texts):
+        self.remove(doc_id)
+        texts = tuple(text.lower() if text else "" for text in texts)
+        self.documents[doc_id] = texts
+        for gram in set().union(*[trigrams(text) for text in texts]):
+            self.postings.setdefault(gram, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        texts = self.documents.pop(doc_id, None)
+        if texts is None:
+            return
+        for gram in set().union(*[trigrams(text) for text in texts]):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self.postings[gram]
+
+    def _substring_candidates(self, query):
+        postings = sorted(
+            (self.postings.get(gram, set()) for gram in substring_grams(query)), key=len
+        )
+        if not postings:
+            return set()
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    def _fuzzy_candidates(self, query_grams):
+        counts = Counter()
+        for gram in query_grams:
+            posting = self.postings.get(gram, ())
+            if len(posting) <= settings["MAX_FUZZY_POSTING"]:
+                counts.update(posting)
+        needed = max(1, int(len(query_grams) * settings["SIMILARITY_THRESHOLD"]))
+        return [doc_id for doc_id, count in counts.most_common(settings["MAX_CANDIDATES"]) if count >= needed]
+
+    def search(self, query):
+        """
+        Returns [(doc_id, score)] best first. Short queries only match prefixes.
+        """
+        query = query.lower().strip()
+        query_grams = trigrams(query)
+        candidates = self._substring_candidates(query)
+        if len(candidates) > settings["MAX_CANDIDATES"]:
+            # very common prefixes, rank the oldest users only
+            candidates = set(heapq.nsmallest(settings["MAX_CANDIDATES"], candidates))
+        fuzzy = len(query) >= 3
+        if fuzzy:
+            candidates.update(self._fuzzy_candidates(query_grams))
+        ranked = []
+        for doc_id in candidates:
+            value = score(query, query_grams, self.documents[doc_id])
+            if value >= 1.0 or (fuzzy and value >= settings["SIMILARITY_THRESHOLD"]):
+                ranked.append((doc_id, value))
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked
+
+
+class SearchIndex:
+    """
+    NgramIndex of the live users kept in sync with the database.
+    loader(since, after_id) returns chunks of rows (id, name, email,
+    phone_number, deleted_at): every live user when since is None, otherwise
+    users updated since the given time or with an id above after_id.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.index = NgramIndex()
+        self._synced_at = None
+        self._max_id = 0
+        self._checked_at = None
+        self._lock = threading.RLock()
+
+    def mark_stale(self):
+        """
+        Forces a catch-up before the next search, used after local writes
+        """
+        self._checked_at = None
+
+    def sync(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < settings["CATCH_UP_SECONDS"]:
+            return
+        with self._lock:
+            started = datetime.datetime.utcnow()
+            since = None if self._synced_at is None else self._synced_at - CLOCK_SKEW
+            for chunk in self.loader(since, self._max_id):
+                for row in chunk:
+                    if row.deleted_at is None:
+                        self.index.add(row.id, (row.name, row.email, row.phone_number))
+                    else:
+                        self.index.remove(row.id)
+                    self._max_id = max(self._max_id, row.id)
+            self._synced_at = started
+            self._checked_at = time.monotonic()
+
+    def search(self, query):
+        self.sync()
+        with self._lock:
+            return self.index.search(query)
+
+    def size(self):
+        return len(self.index.documents)
@@ -0,0 +1,69 @@
+"""
+Precompiled JSON serializers for row tuples.
+A serializer is built once per (columns, fields) combination: every field gets
+its precomputed '"key":' prefix and a type specific encoder, so writing a row
+is a single join with no per row dict building or type dispatch.
+"""
+import json
+from functools import lru_cache
+
+from json.encoder import encode_basestring_ascii
+from sqlalchemy import types
+
+NULL = "null"
+
+
+def _encode_date(value):
+    return '"{}"'.format(value.isoformat())
+
+
+def _encode_bool(value):
+    return "true" if value else "false"
+
+
+def _encoder(column_type):
+    """
+    Picks the encoder of a SQLAlchemy column type, output matches json.dumps
+    """
+    if isinstance(column_type, types.Boolean):
+        return _encode_bool
+    if isinstance(column_type, (types.Date, types.DateTime)):
+        return _encode_date
+    if isinstance(column_type, types.Integer):
+        return int.__repr__
+    if isinstance(column_type, types.String):
+        return encode_basestring_ascii
+    return json.dumps
+
+
+@lru_cache(maxsize=128)
+def row_serializer(table, columns, fields):
+    """
+    Returns a function writing a row tuple, whose values are the given table
+    columns in order, as the JSON object of the given fields
+    """
+    plan = []
+    for position, field in enumerate(fields):
+        prefix = ("{" if position == 0 else ",") + encode_basestring_ascii(field) + ":"
+        plan.append((columns.index(field), prefix, _encoder(table.c[field].type)))
+
+    def serialize(row):
+        parts = []
+        for index, prefix, encode in plan:
+            value = row[index]
+            parts.append(prefix + (NULL if value is None else encode(value)))
+        return "".join(parts) + "}" if parts else "{}"
+
+    return serialize
+
+
+def column_serializer(table, field):
+    """
+    Returns a function writing a list of values of a table column as a JSON array
+    """
+    encode = _encoder(table.c[field].type)
+
+    def serialize(values):
+        return "[" + ",".join([NULL if value is None else encode(value) for value in values]) + "]"
+
+    return serialize
@@ -0,0 +1,64 @@
+"""
+Production server for the application.
+Runs gunicorn in-process: the app is built once in the master before the
+workers are forked (copy-on-write friendly), every worker then drops the
+database connections and bcrypt pool inherited from the master.
+Send HUP to the master to gracefully restart the workers.
+"""
+from gunicorn.app.base import BaseApplication
+
+from constants import REQUEST_TIMEOUT, db
+from utils import hashing
+
+SERVER_DEFAULTS = {
+    "WORKERS": 4,
+    "THREADS": 4,
+    "KEEPALIVE": 5,
+    "TIMEOUT": REQUEST_TIMEOUT,
+    "GRACEFUL_TIMEOUT": 30,
+    "MAX_REQUESTS": 0,
+    "MAX_REQUESTS_JITTER": 0,
+    "BACKLOG": 2048,
+}
+
+
+class Server(BaseApplication):
+    """Pre-forking multi-process server for an already built Flask app"""
+
+    def __init__(self, app, port, config=None, post_fork_hooks=()):
+        self.application = app
+        self.post_fork_hooks = list(post_fork_hooks)
+        settings = dict(SERVER_DEFAULTS)
+        settings.update(config or {})
+        self.options = {
+            "bind": "0.0.0.0:{}".format(port),
+            "workers": settings["WORKERS"],
+            "threads": settings["THREADS"],
+            "worker_class": "gthread" if settings["THREADS"] > 1 else "sync",
+            "keepalive": settings["KEEPALIVE"],
+            "timeout": settings["TIMEOUT"],
+            "graceful_timeout": settings["GRACEFUL_TIMEOUT"],
+            "max_requests": settings["MAX_REQUESTS"],
+            "max_requests_jitter": settings["MAX_REQUESTS_JITTER"],
+            "backlog": settings["BACKLOG"],
+            "preload_app": True,
+            "post_fork": self.post_fork,
+        }
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+    def post_fork(self, server, worker):
+        # Connections and worker processes must never be shared with the master
+        with self.application.app_context():
+            db.get_engine().dispose()
+            for bind in self.application.config.get("SQLALCHEMY_BINDS") or ():
+                db.get_engine(bind=bind).dispose()
+        hashing.shutdown()
+        for hook in self.post_fork_hooks:
+            hook(self.application)
@@ -0,0 +1,56 @@
+"""
+In-memory table of per user token epochs used to revoke auth tokens.
+Tokens carry the epoch of their user at login; bumping the epoch (password,
+role or email change, deletion) revokes every older token. Only users with an
+epoch above 0 are kept and the table is refreshed incrementally, so checking
+a token costs a dict lookup and one small query every refresh_interval seconds.
+"""
+import datetime
+import threading
+import time
+
+from constants import CLOCK_SKEW
+
+
+class EpochTable:
+    def __init__(self, loader, refresh_interval=5):
+        """
+        loader(since) returns [(user_id, epoch)] of users changed since the
+        given time (every user with an epoch when since is None)
+        """
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.epochs = {}
+        self._since = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def current(self, user_id):
+        """
+        Returns the current epoch of a user
+        """
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+        return self.epochs.get(user_id, 0)
+
+    def is_revoked(self, user_id, token_epoch):
+        return token_epoch < self.current(user_id)
+
+    def refresh(self):
+        if not self._lock.acquire(blocking=self._refreshed_at is None):
+            # another thread is refreshing, use the current table meanwhile
+            return
+        try:
+            started = datetime.datetime.utcnow()
+            for user_id, epoch in self.loader(self._since):
+                self.epochs[user_id] = epoch
+            self._since = started - CLOCK_SKEW
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def mark_stale(self):
+        """
+        Forces a refresh on the next check, used after local epoch bumps
+        """
+        self._refreshed_at = None
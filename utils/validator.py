@@ -1,6 +1,8 @@
 """
  Functions to perform validations on received parameters before further processing
 """
+from datetime import date
+
 from decorator import decorator
 from flask import request
 from flask_restx import abort
@@ -8,60 +10,131 @@ from flask_restx import abort
 type_maps = {
     "string": str,
     "integer": int,
+    "number": (int, float),
     "boolean": bool,
 }
 
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def _type_checker(field):
+    """
+    Returns a function returning the (possibly converted) value of a field or
+    raising ValueError, None when the field type is not checked
+    """
+    if field.__schema_type__ == "string" and field.__schema_format__ == "date":
+        return _parse_date
+    expected = type_maps.get(field.__schema_type__)
+    if expected is None:
+        return None
+
+    # bool is a subclass of int, true must not pass as the id 1
+    reject_bool = expected is not bool
+
+    def check(value):
+        if not isinstance(value, expected) or (reject_bool and isinstance(value, bool)):
+            raise ValueError(value)
+        return value
+
+    return check
+
+
+class CompiledModel:
+    """
+    A flask-restx model compiled once into the required set and per field
+    type checkers, so validating a payload does no schema lookups.
+    check_optional also type checks optional fields that are present (None
+    allowed), strict rejects fields the model does not declare.
+    """
+
+    def __init__(self, model, check_optional=False, strict=False):
+        self.required = tuple(name for name, field in model.items() if field.required)
+        self.strict = strict
+        self.fields = frozenset(model.keys())
+        checkers = {name: _type_checker(field) for name, field in model.items()}
+        self.required_checks = tuple(
+            (name, checkers[name]) for name in self.required if checkers[name]
+        )
+        # dates are always parsed, other optional fields only with check_optional
+        self.optional_checks = tuple(
+            (name, checker) for name, checker in checkers.items()
+            if checker and name not in self.required
+            and (check_optional or checker is _parse_date)
+        )
+        self.type_error = {
+            "message": "payload type error",
+            "param_types": {k: str(field.__schema_type__) for k, field in model.items()},
+        }
+
+    def validate(self, params):
+        """
+        Validates params in place (dates become date objects), returns the
+        error response or {} when valid
+        """
+        missing = [name for name in self.required if name not in params]
+        if missing:
+            return {
+                "message": "payload missing required params",
+                "missing": ",".join(missing),
+            }
+        if self.strict:
+            unknown = [name for name in params if name not in self.fields]
+            if unknown:
+                return {
+                    "message": "payload has unknown params",
+                    "unknown": ",".join(unknown),
+                }
+        try:
+            for name, check in self.required_checks:
+                params[name] = check(params[name])
+            for name, check in self.optional_checks:
+                if params.get(name) is not None:
+                    params[name] = check(params[name])
+        except (TypeError, ValueError):
+            return self.type_error
+        return {}
+
+    def validate_many(self, items):
+        """
+        Batch mode, returns one error response per item ({} when valid)
+        """
+        errors = []
+        for item in items:
+            if not isinstance(item, dict):
+                errors.append({"message": "payload must be an object"})
+            else:
+                errors.append(self.validate(item))
+        return errors
+
+
+def compile_model(model, check_optional=False, strict=False):
+    return CompiledModel(model, check_optional=check_optional, strict=strict)
+
+
 def validate_params(params):
     """
-    A decorator which checks and stops execution if the params are invalid
+    A decorator which checks and stops execution if the params are invalid.
+    The model is compiled once, when the decorator is applied.
     """
+    compiled = compile_model(params)
 
     def validate(function, *args, **kwargs):
-        json_obj = {}
         if request.method == "HEAD" or request.method == "OPTIONS":
             return function(*args, **kwargs)
         elif request.args:
-            json_obj.update(request.args)
-        elif request.json:
-            json_obj.update(request.json)
-        elif request.method == "DELETE":
-            json_obj = json_obj
+            json_obj = request.args.to_dict()
+        else:
+            json_obj = request.get_json(silent=True)
+            if not isinstance(json_obj, dict):
+                json_obj = {}
         kwargs["params"] = json_obj
-        response = check_missing_params(params, json_obj)
-        if not response == {}:
-            return abort(400, error=response, success=False)
-        response = check_incorrect_types(params, json_obj)
+        response = compiled.validate(json_obj)
         if not response == {}:
             return abort(400, error=response, success=False)
         return function(*args, **kwargs)
 
     return decorator(validate)
-
-def check_missing_params(params, filtered_params):
-    response = {}
-    missing = [
-        r for r in params.keys() if params[r].required and r not in filtered_params
-    ]
-    if missing:
-        response = {
-            "message": "payload missing required params",
-            "missing": ",".join(missing),
-        }
-    return response
-        
-def check_incorrect_types(params, filtered_params):
-    response = {}
-    wrong_types = [
-        r
-        for r in params.keys()
-        if params[r].required
-        and not isinstance(filtered_params[r], type_maps.get(params[r].__schema_type__))
-    ]
-    if wrong_types:
-        response = {
-            "message": "payload type error",
-            "param_types": {
-            k: str(params[k].__schema_type__) for k in params.keys()
-            },
-        }
-    return response